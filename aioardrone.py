@@ -0,0 +1,366 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+An asyncio version of :class:`libardrone.ARDrone`: all the communications with a drone (navdata, commands, control, video and its decoding process) run as tasks of a single event loop, without threads, so that many drones and other I/O can be driven from one loop. Usage::
+
+  async def main():
+      async with AsyncARDrone() as drone:
+          await drone.takeoff()
+          async for frame in drone.frames():
+              ...
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import asyncio
+import time
+
+import libardrone
+from libardrone import at_ref, at_pcmd, at_ftrim, at_config, at_config_ids, at_comwdg, config_options, default_config
+import arnetwork
+import paveparser
+from navdata import navdata_decode, NAVDATA_HEADER_SIZE
+
+#==================================================================================================
+class AsyncARDrone(object):
+    """
+An instance of this class has the same motion methods as :class:`libardrone.ARDrone`, but the methods which send commands and wait for something are coroutines. The connection is established by :meth:`connect` (or on entering an ``async with`` block) and closed by :meth:`halt`. If *video* is false, the video stream is not decoded.
+    """
+#==================================================================================================
+
+    def __init__(self,host=libardrone.ARDRONE_HOST,hd=False,navdata_demo=True,rate=30.,video=True,ports=None,output=None,ffmpeg_profile=None):
+        self.host = host
+        self.ports = dict(libardrone.ARDRONE_PORTS, **(ports or {}))
+        self.hd = hd
+        self.navdata_demo = navdata_demo
+        self.video = video
+        self.seq_nr = 1
+        self.timer_t = 0.2
+        self.period = 1./rate
+        self.speed = 0.2
+        self.setpoint_ = None
+        self.last_command = time.perf_counter()
+        self.config_ids_string = ['943dac23','36355d78','21d958e4']
+        self.output = (output or arnetwork.OutputSpec())._replace(source=(1280, 720) if hd else (640, 360))
+        self.ffmpeg_profile = ffmpeg_profile or arnetwork.FFmpegProfile()
+        self.image_shape = self.output.shape
+        self.image = self.output.allocate()[0]
+        self.frame = arnetwork.Frame(self.image,0,None)
+        self.navdata = {0:dict(ctrl_state=0,battery=0,theta=0,phi=0,psi=0,altitude=0,vx=0.,vy=0.,vz=0.,num_frames=0)}
+        self.navdata_sample = arnetwork.NavdataSample(self.navdata,0,None)
+        self.commands = None
+        self.navlink = None
+        self.tasks = []
+        self.running = False
+        self.frame_update = self.navdata_update = None # futures of the next updates, created by connect (they need the loop)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self,*a):
+        await self.halt()
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.frame_update = loop.create_future()
+        self.navdata_update = loop.create_future()
+        self.running = True
+        _, self.commands = await loop.create_datagram_endpoint(ATProtocol,remote_addr=(self.host,self.ports['command']))
+        _, self.navlink = await loop.create_datagram_endpoint(lambda: NavdataProtocol(self),remote_addr=(self.host,self.ports['navdata']))
+        self.tasks.append(loop.create_task(self.schedule()))
+        self.tasks.append(loop.create_task(self.navdata_watchdog()))
+        self.tasks.append(loop.create_task(self.control()))
+        if self.video: self.tasks.append(loop.create_task(self.video_process()))
+        await self.config(default_config(self.config_ids_string,self.hd,self.navdata_demo))
+        await asyncio.sleep(1.)
+
+    async def halt(self):
+        """Close all the communications with the drone (see :meth:`libardrone.ARDrone.halt`)."""
+        self.running = False
+        for t in self.tasks: t.cancel()
+        await asyncio.gather(*self.tasks,return_exceptions=True)
+        self.tasks = []
+        for p in (self.commands,self.navlink):
+            if p is not None and p.transport is not None: p.transport.close()
+        for f in (self.frame_update,self.navdata_update):
+            if f is not None and not f.done(): f.set_result(None)
+
+    #----------------------------------------------------------------------------------------------
+    # Commands
+    #----------------------------------------------------------------------------------------------
+
+    def at(self,cmd,*args):
+        """Queue a low level at command (see :meth:`libardrone.ARDrone.at`)."""
+        self.commands.send(cmd(self.seq_nr,*args))
+        self.seq_nr += 1
+        self.last_command = time.perf_counter()
+
+    async def flush(self):
+        """Wait until the queued commands are sent."""
+        await asyncio.sleep(0)
+
+    def setpoint(self,*pcmd):
+        """Set the motion command sent at each tick of the scheduler (see :meth:`libardrone.ARDrone.setpoint`)."""
+        self.setpoint_ = None if pcmd == (None,) else pcmd
+
+    async def takeoff(self):
+        """Make the drone takeoff."""
+        self.at(at_ftrim)
+        self.at(at_ref,True)
+        await self.flush()
+
+    async def land(self):
+        """Make the drone land."""
+        self.setpoint(None)
+        self.at(at_ref,False)
+        await self.flush()
+
+    async def reset(self):
+        """Toggle the drone's emergency state."""
+        self.at(at_ftrim)
+        await asyncio.sleep(0.1)
+        self.at(at_ref,False,True)
+        await asyncio.sleep(0.1)
+        self.at(at_ref,False,False)
+        await self.flush()
+
+    async def config(self,cfg):
+        """Send the configuration keys of dict *cfg*."""
+        self.at(at_config_ids,self.config_ids_string)
+        for k,v in cfg.items():
+            self.at(at_config,k,config_options[k](v))
+        await self.flush()
+
+    def hover(self): self.setpoint(False,0,0,0,0)
+    def move_left(self): self.setpoint(True,-self.speed,0,0,0)
+    def move_right(self): self.setpoint(True,self.speed,0,0,0)
+    def move_up(self): self.setpoint(True,0,0,self.speed,0)
+    def move_down(self): self.setpoint(True,0,0,-self.speed,0)
+    def move_forward(self): self.setpoint(True,0,-self.speed,0,0)
+    def move_backward(self): self.setpoint(True,0,self.speed,0,0)
+    def turn_left(self): self.setpoint(True,0,0,0,-self.speed)
+    def turn_right(self): self.setpoint(True,0,0,0,self.speed)
+    def set_speed(self,speed): self.speed = speed
+
+    async def schedule(self):
+        # same policy as libardrone.CommandScheduler
+        period = self.period
+        deadline = time.perf_counter()
+        while self.running:
+            deadline += period
+            delay = deadline-time.perf_counter()
+            if delay > 0: await asyncio.sleep(delay)
+            else: # late: skip the missed ticks
+                deadline += (-delay//period)*period
+                await asyncio.sleep(0)
+            if self.setpoint_ is not None: self.at(at_pcmd,*self.setpoint_)
+            elif time.perf_counter()-self.last_command >= self.timer_t: self.at(at_comwdg)
+
+    #----------------------------------------------------------------------------------------------
+    # Publication
+    #----------------------------------------------------------------------------------------------
+
+    def set_image(self,image,seq=None,timestamp=None):
+        if seq is None: seq = self.frame.seq+1
+        if timestamp is None: timestamp = time.time()
+        self.frame = arnetwork.Frame(image,seq,timestamp)
+        self.image = image
+        f, self.frame_update = self.frame_update, self.frame_update.get_loop().create_future()
+        f.set_result(self.frame)
+
+    def set_navdata(self,navdata,timestamp=None):
+        if timestamp is None: timestamp = time.time()
+        self.navdata_sample = arnetwork.NavdataSample(navdata,self.navdata_sample.seq+1,timestamp)
+        self.navdata = navdata
+        f, self.navdata_update = self.navdata_update, self.navdata_update.get_loop().create_future()
+        f.set_result(self.navdata_sample)
+
+    async def wait_frame(self,after_seq=None,timeout=None):
+        """Coroutine version of :meth:`libardrone.ARDrone.wait_frame`."""
+        return await self._wait('frame','frame_update',after_seq,timeout)
+
+    async def wait_navdata(self,after_seq=None,timeout=None):
+        """Coroutine version of :meth:`libardrone.ARDrone.wait_navdata`."""
+        return await self._wait('navdata_sample','navdata_update',after_seq,timeout)
+
+    async def frames(self,timeout=None):
+        """Asynchronous iterator version of :meth:`libardrone.ARDrone.frames`."""
+        seq = None
+        while True:
+            x = await self.wait_frame(seq,timeout)
+            if x is None: return
+            seq = x.seq
+            yield x
+
+    async def navdata_updates(self,timeout=None):
+        """Asynchronous iterator version of :meth:`libardrone.ARDrone.navdata_updates`."""
+        seq = None
+        while True:
+            x = await self.wait_navdata(seq,timeout)
+            if x is None: return
+            seq = x.seq
+            yield x
+
+    async def _wait(self,attr,update,after_seq,timeout):
+        if after_seq is None: after_seq = getattr(self,attr).seq
+        while self.running and getattr(self,attr).seq <= after_seq:
+            try: await asyncio.wait_for(asyncio.shield(getattr(self,update)),timeout)
+            except asyncio.TimeoutError: return None
+        return getattr(self,attr) if self.running else None
+
+    #----------------------------------------------------------------------------------------------
+    # Network tasks
+    #----------------------------------------------------------------------------------------------
+
+    async def navdata_watchdog(self):
+        # wake the navdata stream up again when it has stopped for a second
+        while self.running:
+            n = self.navlink.received
+            await asyncio.sleep(1.)
+            if self.navlink.received == n:
+                logger.info('[navdata] No navdata, reconnecting')
+                self.navlink.wakeup()
+
+    async def control(self):
+        try: reader, writer = await asyncio.open_connection(self.host,self.ports['control'])
+        except OSError as e:
+            logger.warning('[control] Connection failed: %s',e)
+            return
+        logger.info('[control] Connection established')
+        try:
+            while True:
+                data = await reader.read(65535)
+                if not data:
+                    logger.warning('[control] Received an empty packet on control socket')
+                    break
+                logger.warning('[control] %s',data)
+        finally:
+            writer.close()
+
+    async def video_process(self):
+        # ffmpeg writes to a plain pipe, read by arnetwork.readinto in a thread straight into the pool buffers (a stream reader would copy each frame twice)
+        loop = asyncio.get_running_loop()
+        r, w = os.pipe()
+        try: proc = await asyncio.create_subprocess_exec(*arnetwork.ffmpeg_command(self.output,self.ffmpeg_profile),stdin=asyncio.subprocess.PIPE,stdout=w,stderr=asyncio.subprocess.DEVNULL)
+        except BaseException:
+            os.close(r)
+            raise
+        finally: os.close(w)
+        pipe = open(r,'rb',buffering=0)
+        parse = loop.create_task(self.video_parse(proc.stdin))
+        pool = arnetwork.FramePool(self.output)
+        read = None
+        seq = 0
+        try:
+            logger.info('[video_process] Starting loop')
+            while True:
+                x, buf = pool.next()
+                read = loop.run_in_executor(None,arnetwork.readinto,pipe,buf)
+                if not await read: break
+                read = None
+                seq += 1
+                self.set_image(x,seq,time.time())
+        finally:
+            logger.info('[video_process] Stopping loop')
+            parse.cancel()
+            if proc.returncode is None: proc.terminate()
+            await proc.wait()
+            if read is not None: await asyncio.wait((read,)) # ends at the end of the stream
+            pipe.close()
+
+    async def video_parse(self,stdin):
+        reader, writer = await asyncio.open_connection(self.host,self.ports['video'])
+        parser = paveparser.PaVERingParser(stdin) # stdin.write copies the payload views into its own buffer
+        try:
+            logger.info('[video_parse] Starting loop')
+            while True:
+                data = await reader.read(65536)
+                if not data: break
+                parser.write(data)
+                await stdin.drain()
+        finally:
+            logger.info('[video_parse] Stopping loop')
+            writer.close()
+            stdin.close()
+
+#==================================================================================================
+class ATProtocol(asyncio.DatagramProtocol):
+    """
+Sends AT commands. The commands queued during the same iteration of the event loop are coalesced, in order, into datagrams of at most :attr:`libardrone.ATChannel.MAX_DATAGRAM` bytes.
+    """
+#==================================================================================================
+
+    def __init__(self):
+        self.transport = None
+        self.pending = []
+        self.commands_sent = 0
+        self.datagrams_sent = 0
+
+    def connection_made(self,transport):
+        self.transport = transport
+
+    def send(self,msg):
+        if not self.pending: asyncio.get_running_loop().call_soon(self.flush)
+        self.pending.append(msg)
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if self.transport is None or self.transport.is_closing(): return
+        datagram = b''
+        for msg in pending:
+            if datagram and len(datagram)+len(msg) > libardrone.ATChannel.MAX_DATAGRAM:
+                self.transport.sendto(datagram)
+                self.datagrams_sent += 1
+                datagram = b''
+            datagram += msg
+        self.transport.sendto(datagram)
+        self.datagrams_sent += 1
+        self.commands_sent += len(pending)
+
+#==================================================================================================
+class NavdataProtocol(asyncio.DatagramProtocol):
+    """Receives the navdata packets and publishes them to *drone*."""
+#==================================================================================================
+
+    def __init__(self,drone):
+        self.drone = drone
+        self.transport = None
+        self.received = 0
+
+    def connection_made(self,transport):
+        self.transport = transport
+        self.wakeup()
+        logger.info('[navdata] Connection established')
+
+    def wakeup(self):
+        if not self.transport.is_closing(): self.transport.sendto(b'\x01\x00\x00\x00')
+
+    def datagram_received(self,data,addr):
+        self.received += 1
+        if len(data) < NAVDATA_HEADER_SIZE: return
+        navdata, has_information = navdata_decode(data)
+        if has_information: self.drone.set_navdata(navdata)
+
+    def error_received(self,exc):
+        logger.warning('[navdata] %s',exc)
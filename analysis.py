@@ -0,0 +1,173 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Per-frame analysis in a pool of processes, out of the reach of the GIL of the decoding and navdata threads. The analysis functions registered on a drone are run on its new frames as long as a worker is free; the frames which come while all the workers are busy are dropped, so the results are always about recent frames and the backlog never grows. Usage::
+
+  def faces(image, navdata): # a module level function, run in the worker processes
+      ...
+
+  drone = ARDrone(frame_ring='drone0') # the workers read the frames from the ring, without copy
+  drone.analyze(faces, callback=lambda result: print(result.seq, result.value))
+  ...
+  drone.analysis.stats()
+"""
+
+import os
+import time
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+import numpy
+from collections import namedtuple, deque
+
+from navdata import HISTORY_DTYPE, history_record
+from framering import FrameRing
+
+logger = logging.getLogger(__name__)
+
+# The result of an analysis function on a frame, with the frame's sequence number, time and navdata sample (record of
+# navdata.HISTORY_DTYPE, or None), the time from the frame publication to the result and the time spent in the function
+# (in seconds). valid is false if the frame was overwritten in the ring before the function returned.
+AnalysisResult = namedtuple('AnalysisResult', 'name seq timestamp navdata value latency compute valid')
+
+_rings = dict() # rings attached by the worker process, by name
+
+def run_task(function, name, slot, version, image, navdata):
+    # runs in a worker: the image is either passed, or read in place from the slot of ring *name*
+    t = time.perf_counter()
+    ring = None
+    if image is None:
+        ring = _rings.get(name)
+        if ring is None: ring = _rings[name] = FrameRing.attach(name)
+        if int(ring.versions[slot]) != version: return None # overwritten before the task started: not analyzed
+        image = ring.images[slot]
+    value = function(image, navdata)
+    valid = ring is None or int(ring.versions[slot]) == version
+    return value, valid, time.perf_counter() - t
+
+#==================================================================================================
+class AnalysisPool(object):
+    """
+Runs the analysis functions registered with :meth:`add` in *workers* processes (default: one per core) on each frame submitted with :meth:`submit`. A function is called as ``function(image, navdata)`` and must be picklable (defined at module level); its results are passed as :class:`AnalysisResult` to its callback, called in a thread of the pool, and kept as the latest result of the function in :attr:`results`. A frame is dropped for a function when as many tasks as workers are in flight.
+
+If *ring* (a :class:`framering.FrameRing`) is not None, the workers read the images from it in place; otherwise they are copied when submitted (the decoder reuses its buffers) and pickled to the workers. The statistics over the last *window* tasks are returned by :meth:`stats`.
+    """
+#==================================================================================================
+
+    def __init__(self, ring=None, workers=None, window=1024):
+        self.ring = ring
+        self.workers = workers or os.cpu_count() or 1
+        # not forked: the workers start while the network threads may hold locks
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+        for _ in range(self.workers): self.executor.submit(int) # start the workers now, not with the first frames
+        self.functions = [] # (name, function, callback)
+        self.results = dict() # latest result by function name
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.closed = False
+        self.submitted = self.dropped = self.completed = self.stale = self.failed = 0
+        self.latencies = deque(maxlen=window)
+        self.computes = deque(maxlen=window)
+        self.done_times = deque(maxlen=window)
+
+    def add(self, function, callback=None, name=None):
+        """Registers *function*, under *name* (default: its name), with *callback* (or None) to call with its results."""
+        name = function.__name__ if name is None else name
+        self.functions.append((name, function, callback))
+        return name
+
+    def submit(self, image, seq, timestamp, navdata=None):
+        """Submits the frame just published (with the current :class:`arnetwork.NavdataSample` *navdata*) to the functions with a free worker. Never blocks."""
+        if not self.functions or self.closed: return
+        t = time.perf_counter()
+        with self.lock: # reserve the free workers first: a dropped frame costs nothing
+            functions = self.functions[:max(self.workers - self.in_flight, 0)]
+            self.dropped += len(self.functions) - len(functions)
+            self.in_flight += len(functions)
+            self.submitted += len(functions)
+        if not functions: return
+        if self.ring is not None:
+            frame = self.ring.latest()
+            if frame is None: # closed meanwhile
+                self.release(len(functions))
+                return
+            args = (self.ring.name, frame.slot, frame.version, None, frame.navdata)
+        else:
+            record = None if navdata is None or navdata.timestamp is None else numpy.array(history_record(navdata.timestamp, navdata.navdata), dtype=HISTORY_DTYPE)[()]
+            image = type(image)(*(x.copy() for x in image)) if isinstance(image, tuple) else image.copy() # pickled later, after the pool reuses its buffer
+            args = (None, None, None, image, record)
+        for i, (name, function, callback) in enumerate(functions):
+            try: future = self.executor.submit(run_task, function, *args)
+            except RuntimeError: # shut down
+                self.release(len(functions) - i)
+                return
+            future.add_done_callback(lambda f, name=name, callback=callback: self.complete(f, name, callback, seq, timestamp, args[-1], t))
+
+    def release(self, n):
+        """Gives back *n* workers reserved by :meth:`submit` for tasks finally not submitted."""
+        with self.lock:
+            self.in_flight -= n
+            self.submitted -= n
+
+    def complete(self, future, name, callback, seq, timestamp, navdata, submitted):
+        t = time.perf_counter()
+        with self.lock:
+            self.in_flight -= 1
+            if future.cancelled(): return
+            error = future.exception()
+            if error is not None:
+                self.failed += 1
+                logger.warning('[AnalysisPool] %s failed on frame %d: %r', name, seq, error)
+                return
+            r = future.result()
+            if r is None: # frame overwritten before the task started
+                self.stale += 1
+                return
+            value, valid, compute = r
+            self.completed += 1
+            if not valid: self.stale += 1
+            self.latencies.append(t - submitted)
+            self.computes.append(compute)
+            self.done_times.append(t)
+            result = self.results[name] = AnalysisResult(name, seq, timestamp, navdata, value, t - submitted, compute, valid)
+        if callback is not None: callback(result)
+
+    def stats(self):
+        """
+Returns a dict of the counts of tasks (submitted, completed, dropped, failed, and stale: whose frame was overwritten in the ring before the task started, or while it ran, in which case it is also completed), the drop rate (dropped frames per frame offered to a function), the queue depth (tasks in flight), the analyzed frames/sec and the statistics (in ms) of the latency (frame publication to result) and compute time of the last tasks.
+        """
+        with self.lock:
+            r = dict(submitted=self.submitted, completed=self.completed, dropped=self.dropped, stale=self.stale, failed=self.failed, queue_depth=self.in_flight,
+              drop_rate=self.dropped / max(self.submitted + self.dropped, 1))
+            if len(self.done_times) > 1: r['analyzed_fps'] = (len(self.done_times) - 1) / (self.done_times[-1] - self.done_times[0])
+            for key, values in (('latency', self.latencies), ('compute', self.computes)):
+                if not values: continue
+                x = numpy.array(values) * 1e3
+                p50, p99 = numpy.percentile(x, (50, 99))
+                r[key] = dict(p50=float(p50), p99=float(p99), mean=float(x.mean()), max=float(x.max()))
+        return r
+
+    def close(self):
+        """Stops the workers, dropping the tasks not started and waiting for the running ones."""
+        self.closed = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,269 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Configuration of the drone. The drone acknowledges a configuration command by setting the ``command_mask`` bit of the drone state, which the client then resets with ``AT*CTRL=...,5,0`` (ACK_CONTROL_MODE), before sending the next one. On ``AT*CTRL=...,4,0`` (CFG_GET_CONTROL_MODE), the drone sends its whole configuration as text (``section:key = value`` lines) on the control port.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import re
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import libardrone
+
+CFG_GET_CONTROL_MODE = 4
+ACK_CONTROL_MODE = 5
+COMMAND_MASK = 1 << 6 # bit of the acknowledgement in the drone state word
+
+#==================================================================================================
+class ConfigManager(object):
+    """
+An instance of this class writes the configuration of *drone* by transactions. Method :meth:`write` queues a transaction and returns a :class:`concurrent.futures.Future`, whose result is the dict of the keys written, once the drone has acknowledged them. The keys of a transaction are sent together (each preceded by the CONFIG_IDS of the drone, as required in multiconfiguration mode), and acknowledged at once; the transactions are run one at a time.
+
+The last acknowledged value of each key is cached in attribute :attr:`values`: the keys whose value is unchanged (or already queued) are not sent again. The protocol is driven by the drone state words passed to :meth:`on_state` with each navdata packet, and by :meth:`on_tick`, called periodically (by the command scheduler of the drone) so that the deadlines are kept even if the navdata stops. A transaction which is not acknowledged within *timeout* seconds is sent again, up to *retries* times, after which its future fails with :class:`TimeoutError`. If *acknowledged* is false (e.g. replay), the transactions complete as soon as they are sent.
+    """
+#==================================================================================================
+
+    def __init__(self, drone, timeout=1., retries=3, acknowledged=True):
+        self.drone = drone
+        self.timeout = timeout
+        self.retries = retries
+        self.acknowledged = acknowledged
+        self.values = dict() # last acknowledged values
+        self.latest = dict() # last acknowledged or queued values
+        self.queue = deque() # pending transactions, as pairs (dict of keys, future)
+        self.current = None
+        self.phase = None # of the current transaction: 'reset', 'sent' or 'acked'
+        self.deadline = 0.
+        self.attempts = 0
+        self.ack = None # state of the acknowledgement bit, None until the first navdata packet
+        self.listeners = [] # called with the dict of the keys written by each transaction
+        self.lock = threading.Lock()
+
+    def write(self, cfg):
+        """Queues the writing of the keys of dict *cfg* (values checked and encoded by :data:`libardrone.config_options`). Returns a future."""
+        items = dict()
+        for k, v in cfg.items():
+            v = libardrone.config_options[k](v)
+            if self.latest.get(k) != v: items[k] = v
+        future = Future()
+        if not items:
+            future.set_result(items)
+            return future
+        with self.lock:
+            self.latest.update(items)
+            if not self.acknowledged:
+                self.send(items)
+                self.values.update(items)
+                done = [(items, future, None)]
+            else:
+                self.queue.append((items, future))
+                done = self.step()
+        self.complete(done)
+        return future
+
+    def on_state(self, word):
+        """Drives the protocol with the drone state *word* of a navdata packet."""
+        if not self.acknowledged: return
+        with self.lock:
+            self.ack = word & COMMAND_MASK
+            done = self.step()
+        self.complete(done)
+
+    def on_tick(self):
+        """Drives the retries and timeouts of the protocol between navdata packets."""
+        if not self.acknowledged or self.current is None and not self.queue: return
+        with self.lock:
+            done = self.step()
+        self.complete(done)
+
+    def step(self):
+        # advances the current transaction; returns the completed ones
+        done = []
+        now = time.perf_counter()
+        while True:
+            if self.current is None:
+                if not self.queue: return done
+                self.current = self.queue.popleft()
+                self.phase = 'reset'
+                self.attempts = 0
+                self.deadline = 0.
+            items, future = self.current
+            if self.phase == 'reset': # waits for the acknowledgement of a previous command to be reset (or for the first navdata packet)
+                if self.ack is not None and not self.ack:
+                    self.send(items)
+                    self.phase = 'sent'
+                    self.attempts = 0
+                    self.deadline = now + self.timeout
+                elif now >= self.deadline:
+                    if self.expire(now, done): continue
+                    if self.ack is not None: self.drone.at(libardrone.at_ctrl, ACK_CONTROL_MODE)
+                return done
+            if self.phase == 'sent':
+                if self.ack:
+                    self.drone.at(libardrone.at_ctrl, ACK_CONTROL_MODE)
+                    self.phase = 'acked'
+                    self.attempts = 0
+                    self.deadline = now + self.timeout
+                elif now >= self.deadline:
+                    if self.expire(now, done): continue
+                    self.send(items)
+                return done
+            if self.phase == 'acked': # waits for the acknowledgement to be reset
+                if not self.ack:
+                    self.values.update(items)
+                    done.append((items, future, None))
+                    self.current = None
+                    continue
+                if now >= self.deadline:
+                    if self.expire(now, done): continue
+                    self.drone.at(libardrone.at_ctrl, ACK_CONTROL_MODE)
+                return done
+
+    def expire(self, now, done):
+        # counts an attempt of the current transaction, whose deadline has passed, and sets the next one; fails it after the last attempt
+        self.attempts += 1
+        self.deadline = now + self.timeout
+        if self.attempts <= self.retries: return False
+        items, future = self.current
+        logger.warning('[config] No acknowledgement of %s', items)
+        for k in items: self.latest[k] = self.values.get(k)
+        done.append((items, future, TimeoutError('configuration not acknowledged: {}'.format(', '.join(items)))))
+        self.current = None
+        return True
+
+    def send(self, items):
+        ids = self.drone.config_ids_string
+        for k, v in items.items():
+            self.drone.at(libardrone.at_config_ids, ids)
+            self.drone.at(libardrone.at_config, k, v)
+
+    def complete(self, done):
+        # outside of the lock, as the futures run their callbacks
+        for items, future, exception in done:
+            if exception is not None:
+                future.set_exception(exception)
+                continue
+            for listener in self.listeners: listener(items)
+            future.set_result(items)
+
+    def cancel(self):
+        """Cancels the pending transactions."""
+        with self.lock:
+            pending = list(self.queue)
+            if self.current is not None: pending.insert(0, self.current)
+            self.queue.clear()
+            self.current = None
+        for _, future in pending: future.cancel()
+
+#==================================================================================================
+# Configuration dump
+#==================================================================================================
+
+CONFIG_LINE = re.compile(r'^\s*([A-Za-z0-9_]+:[A-Za-z0-9_]+)\s*=\s*(.*?)\s*$', re.MULTILINE)
+
+def parse_value(v):
+    """Converts a value of the configuration dump to a bool (TRUE/FALSE), int or float if possible, otherwise leaves it a string."""
+    if v == 'TRUE': return True
+    if v == 'FALSE': return False
+    try: return int(v)
+    except ValueError: pass
+    try: return float(v)
+    except ValueError: return v
+
+def parse_config(text):
+    """Parses the configuration dump *text* into a dict keyed like :data:`libardrone.config_options` (e.g. ``video:bitrate``)."""
+    return dict((k, parse_value(v)) for k, v in CONFIG_LINE.findall(text))
+
+#==================================================================================================
+class ConfigCache(object):
+    """
+An instance of this class fetches the configuration of *drone* from the control port and caches it. Method :meth:`fetch` sends the request and returns a future of the parsed configuration. The text is reassembled from the data passed to :meth:`feed` by the control socket; it is complete at a null byte, or when no data has arrived for *quiet* seconds, as checked by :meth:`on_tick` with each navdata packet. A fetch fails with :class:`TimeoutError` if no data arrives within *timeout* seconds.
+
+Method :meth:`get` returns the cached configuration, fetched again only if a key written since (see :meth:`invalidate`, registered with the :class:`ConfigManager` of the drone) is read.
+    """
+#==================================================================================================
+
+    def __init__(self, drone, quiet=.1, timeout=2.):
+        self.drone = drone
+        self.quiet = quiet
+        self.timeout = timeout
+        self.config = None # last configuration fetched
+        self.stale = set() # keys written since
+        self.buffer = bytearray()
+        self.future = None # fetch in progress
+        self.deadline = 0.
+        self.lock = threading.Lock()
+
+    def get(self, key=None, timeout=5.):
+        """Returns the value of *key*, or the whole configuration if None (a dict not to be modified), fetching it if needed."""
+        with self.lock:
+            config, stale = self.config, self.stale
+            fresh = config is not None and (key not in stale if key is not None else not stale)
+        if not fresh: config = self.fetch().result(timeout)
+        return config if key is None else config[key]
+
+    def fetch(self):
+        """Requests the configuration; returns a future of the parsed dict."""
+        with self.lock:
+            if self.future is not None: return self.future
+            future = self.future = Future()
+            del self.buffer[:]
+            self.stale = set()
+            self.deadline = time.perf_counter() + self.timeout
+        self.drone.at(libardrone.at_ctrl, CFG_GET_CONTROL_MODE)
+        return future
+
+    def invalidate(self, items):
+        with self.lock:
+            self.stale.update(items)
+
+    def feed(self, data):
+        """Passes data received on the control socket."""
+        with self.lock:
+            if self.future is None:
+                logger.info('[control] Unexpected data: %r', bytes(data[:100]))
+                return
+            self.buffer += data
+            self.deadline = time.perf_counter() + self.quiet
+            complete = b'\0' in data
+        if complete: self.complete()
+
+    def on_tick(self):
+        with self.lock:
+            if self.future is None or time.perf_counter() < self.deadline: return
+        self.complete()
+
+    def complete(self):
+        with self.lock:
+            future, self.future = self.future, None
+            if future is None: return
+            if not self.buffer:
+                exception = TimeoutError('no configuration received')
+            else:
+                exception = None
+                self.config = parse_config(self.buffer.split(b'\0', 1)[0].decode('ascii', 'replace'))
+        if exception is None: future.set_result(self.config)
+        else: future.set_exception(exception)
@@ -22,15 +22,18 @@ import logging
 logger = logging.getLogger(__name__)
 
 import re
+import time
 import threading
 import select
 import socket
 import subprocess
-import struct
 import numpy
+from collections import namedtuple, deque
 
 import libardrone
 import paveparser
+from navdata import navdata_decode, drone_state_word, NAVDATA_MAX_SIZE, NAVDATA_HEADER_SIZE
+from recording import NAVDATA, VIDEO, SEEK
 
 #==================================================================================================
 class network (object):
@@ -39,19 +42,26 @@ class network (object):
 An instance of this class collects the sensor data from the drone and updates the :attr:`image` and :attr:`navdata` attributes of *drone*\.
     """
 
-    def __init__(self,drone):
-        wifi_connect(done.ssid)
+    def __init__(self,drone,video=True):
+        self.ssid = drone.ssid
+        self.reactor = drone.reactor
+        if self.ssid is not None: wifi_connect(self.ssid)
         self.running = True
         self.threads = []
-        self.threads.extend(ctrlvideo(drone,self))
-        self.threads.extend(ctrlnavdata(drone,self))
+        self.navlink = None # attached to the reactor, if any (not with a replay)
+        if drone.replay is not None:
+            self.threads.extend(ctrlreplay(drone,self,video))
+        else:
+            if video: self.threads.extend(ctrlvideo(drone,self))
+            self.threads.extend(ctrlnavdata(drone,self))
         for t in self.threads:
             t.daemon = True # just in case it cannot be joined on exit
             t.start()
     def halt(self):
         self.running = False
+        if self.navlink is not None and self.reactor is not None: self.reactor.call_soon(self.navlink.disconnect)
         for t in self.threads: t.join(1.)
-        wifi_disconnect()
+        if self.ssid is not None: wifi_disconnect()
 
 def wifi_connect(ssid):
     logger.info('Scanning wifi networks for SSID=%s...',ssid)
@@ -76,165 +86,475 @@ def wifi_disconnect():
 #==================================================================================================
 def ctrlvideo(drone,main):
 #==================================================================================================
+    sink, threads = drone.decoder.open(drone,main)
+    return [threading.Thread(target=video_parse,args=(sink,drone,main))]+threads
+
+def ffmpeg_command(output=None,profile=None):
+    """Command line of the ffmpeg process decoding the H264 stream on stdin into raw images on stdout, as specified by *output* (an :class:`OutputSpec`, full size rgb24 by default), with the options of *profile* (an :class:`FFmpegProfile`, low latency by default)."""
+    if output is None: output = OutputSpec()
+    if profile is None: profile = FFmpegProfile()
     ffmpeg = libardrone.FFMPEG
     if ffmpeg is None: ffmpeg = 'ffmpeg'
-    cmd = (ffmpeg,
+    return (ffmpeg,
+      )+profile.input_args()+(
       '-i','-',
       '-f','image2pipe',
-      '-pix_fmt', 'rgb24',
+      )+output.ffmpeg_args()+profile.output_args()+(
       '-codec:v','rawvideo',
       '-')
-    sub = subprocess.Popen(cmd,stdin=subprocess.PIPE,stdout=subprocess.PIPE,bufsize=0)
-    tparse = threading.Thread(target=video_parse,args=(sub.stdin,main))
-    tproc = threading.Thread(target=video_process,args=(sub.stdout,sub,drone,main))
-    return tparse,tproc
-
-def video_parse(pipe,main):
-    sock = socket.create_connection(('192.168.1.1',libardrone.ARDRONE_VIDEO_PORT))
-    parser = paveparser.PaVEParser(pipe)
+
+#==================================================================================================
+class Decoder (object):
+    """
+Base class of the H.264 decoder backends of the video stream. Method :meth:`open` is called with the drone and the :class:`network` instance when the stream starts. It returns the file object to which the PaVE parser writes the H.264 payloads (closed at the end of the stream) and the list of the threads to start along with the parser. The decoded images are published by :meth:`libardrone.ARDrone.set_image`, in the format ``drone.output``, with the trace returned by :meth:`FrameTracer.decoded` if ``drone.tracer`` is not None.
+    """
+#==================================================================================================
+    def open(self,drone,main):
+        raise NotImplementedError
+
+class FFmpegDecoder (Decoder):
+    """Decodes the stream in an ffmpeg process started with the options of *profile* (an :class:`FFmpegProfile`, low latency by default): the payloads are written to its stdin and the images read from its stdout by :func:`video_process`."""
+    def __init__(self,profile=None):
+        self.profile = FFmpegProfile() if profile is None else profile
+    def open(self,drone,main):
+        sub = subprocess.Popen(ffmpeg_command(drone.output,self.profile),stdin=subprocess.PIPE,stdout=subprocess.PIPE,bufsize=0)
+        return sub.stdin, [threading.Thread(target=video_process,args=(sub.stdout,sub,drone,main))]
+
+class PyAVDecoder (Decoder):
+    """
+Decodes the stream in process with libav, through PyAV (package ``av``), using *threads* slice threads. Each payload is decoded by the thread of the parser as soon as it is written, and the image is converted (by libswscale, if needed) and copied into a :class:`FramePool` image: no pipe, no process switch, and no other copy of the image.
+    """
+    def __init__(self,threads=1):
+        import av # optional dependency, needed by this backend only
+        self.av = av
+        self.threads = threads
+    def open(self,drone,main):
+        return PyAVSink(self.av,drone,self.threads), []
+
+class PyAVSink (object):
+    """File object decoding the H.264 payloads written to it with the PyAV module *av*, and publishing the images as soon as they are decoded."""
+    def __init__(self,av,drone,threads=1):
+        self.av = av
+        self.context = av.CodecContext.create('h264','r')
+        self.context.thread_type = 'SLICE'
+        self.context.thread_count = threads
+        self.context.options = dict(flags='low_delay')
+        self.drone = drone
+        self.pool = FramePool(drone.output,ring=drone.frame_ring)
+        self.seq = 0
+        self.errors = 0
+
+    def write(self,data):
+        try: frames = self.context.decode(self.av.Packet(bytes(data))) # data is only valid during the call
+        except ValueError as e: # corrupt payload (the errors of PyAV are also ValueError)
+            self.errors += 1
+            logger.debug('[PyAVSink] %s',e)
+            return
+        tracer = self.drone.tracer
+        for frame in frames:
+            x, _ = self.pool.next()
+            self.convert(frame,x)
+            self.seq += 1
+            if tracer is None: self.drone.set_image(x,self.seq,time.time())
+            else: self.drone.set_image(x,self.seq,time.time(),tracer.decoded())
+
+    def convert(self,frame,image):
+        """Copies the decoded *frame* (an :class:`av.VideoFrame`) into *image*, in the format of the drone's :class:`OutputSpec`."""
+        output = self.drone.output
+        w, h = output.dimensions
+        x0 = y0 = 0
+        if output.crop is None: frame = frame.reformat(width=w,height=h,format=output.pix_fmt)
+        else: # scale the whole frame so that the crop region has the output size, then crop
+            x, y, cw, ch = output.crop
+            frame = frame.reformat(width=int(round(frame.width*w/cw)),height=int(round(frame.height*h/ch)),format=output.pix_fmt)
+            x0, y0 = int(round(x*w/cw))//2*2, int(round(y*h/ch))//2*2
+        bpp = 3 if output.pix_fmt == 'rgb24' else 1
+        for k, (plane, dst) in enumerate(zip(frame.planes,image if output.pix_fmt == 'yuv420p' else (image,))):
+            d = 2 if k else 1 # subsampling of the chroma planes
+            rows = numpy.frombuffer(plane,dtype='uint8').reshape(-1,plane.line_size)
+            numpy.copyto(dst.reshape(dst.shape[0],-1),rows[y0//d:y0//d+dst.shape[0],x0//d*bpp:(x0//d+dst.shape[1])*bpp])
+
+    def close(self):
+        pass
+
+#==================================================================================================
+class FFmpegProfile (namedtuple('FFmpegProfile','low_latency threads')):
+    """
+The options of the ffmpeg decoding process. If *low_latency* is true, the input is declared as raw H.264 (the PaVE payloads) instead of being probed, ffmpeg reads and decodes it without buffering (``-probesize 32 -analyzeduration 0 -fflags nobuffer -flags low_delay``) and flushes each image to the pipe as soon as it is decoded. Otherwise ffmpeg probes the stream first, which delays the first image by up to several seconds. The decoder uses *threads* threads (0 lets ffmpeg choose): several threads split the frames by slices, since frame threading would delay each image by one frame per thread.
+    """
+#==================================================================================================
+    __slots__ = ()
+
+    def __new__(cls,low_latency=True,threads=1):
+        return super(FFmpegProfile,cls).__new__(cls,low_latency,threads)
+
+    def input_args(self):
+        """Returns the ffmpeg input options."""
+        threads = ('-threads',str(self.threads),'-thread_type','slice')
+        if not self.low_latency: return threads
+        return ('-f','h264','-probesize','32','-analyzeduration','0','-fflags','nobuffer','-flags','low_delay')+threads
+
+    def output_args(self):
+        """Returns the ffmpeg output options."""
+        return ('-flush_packets','1') if self.low_latency else ()
+
+def video_parse(pipe,drone,main):
+    sock = socket.create_connection((drone.host,drone.ports['video']))
+    tracer, recorder = drone.tracer, drone.recorder
+    parser = paveparser.PaVERingParser(pipe,tracer=tracer)
     try:
         logger.info('[video_parse] Starting loop')
         while main.running:
-            data = sock.recv(65565)
-            parser.write(data)
+            buf = parser.reserve(65536)
+            n = sock.recv_into(buf)
+            if tracer is not None: tracer.recv = time.perf_counter()
+            if recorder is not None: recorder.video(buf[:n])
+            parser.commit(n)
     finally:
         logger.info('[video_parse] Stopping loop')
         pipe.close()
 
 def video_process(pipe,sub,drone,main):
-    imgshape = drone.image.shape
-    imgsize = imgshape[0]*imgshape[1]*imgshape[2]
+    pool = FramePool(drone.output,ring=drone.frame_ring)
+    tracer = drone.tracer
+    seq = 0
     try:
         logger.info('[video_process] Starting loop')
         while main.running:
-            try: x = numpy.fromstring(pipe.read(imgsize),count=imgsize,dtype='uint8')
+            x, buf = pool.next()
+            try:
+                if not readinto(pipe,buf): break
             except IOError: break
-            x.shape = imgshape
-            drone.set_image(x)
-            pipe.flush()
+            seq += 1
+            if tracer is None: drone.set_image(x,seq,time.time())
+            else: drone.set_image(x,seq,time.time(),tracer.decoded())
     finally:
         logger.info('[video_process] Stopping loop')
         sub.terminate()
 
+def readinto(pipe,buf):
+    """Fills *buf* (a byte memoryview) from *pipe*. Returns False if the end of the stream is reached first."""
+    n, size = 0, len(buf)
+    while n < size:
+        k = pipe.readinto(buf[n:])
+        if not k: return False
+        n += k
+    return True
+
+# A published image, with its sequence number, capture time and FrameTrace (None if not traced)
+Frame = namedtuple('Frame','image seq timestamp trace')
+Frame.__new__.__defaults__ = (None,)
+# A published navdata packet, with its sequence number and reception time
+NavdataSample = namedtuple('NavdataSample','navdata seq timestamp')
+
+# The planes of a yuv420p image
+Planes = namedtuple('Planes','y u v')
+
 #==================================================================================================
-def ctrlnavdata(drone,main):
+class OutputSpec (namedtuple('OutputSpec','pix_fmt size crop source')):
+    """
+The format of the images decoded from the video stream of *source* size (width, height): pixel format *pix_fmt* (``'rgb24'``, ``'gray'`` or ``'yuv420p'``), region *crop* (x, y, width, height) of the source, or None for all of it, scaled to *size*, either (width, height), a scale factor, or None for no scaling. The cropping and scaling are done by ffmpeg, so that only the bytes needed go through the pipe. The images are :class:`numpy.ndarray` of shape (height, width, 3) for rgb24, (height, width) for gray, and :class:`Planes` of 3 arrays for yuv420p.
+    """
 #==================================================================================================
-    t = threading.Thread(target=navdata_process,args=(drone,main))
-    return (t,)
+    __slots__ = ()
+    PIX_FMTS = ('rgb24','gray','yuv420p')
 
-def navdata_process(drone,main):
-    def _connect():
-        nav_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        nav_socket.setblocking(0)
-        nav_socket.bind(('', libardrone.ARDRONE_NAVDATA_PORT))
-        nav_socket.sendto("\x01\x00\x00\x00", ('192.168.1.1', libardrone.ARDRONE_NAVDATA_PORT))
-        control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        control_socket.connect(('192.168.1.1', libardrone.ARDRONE_CONTROL_PORT))
-        control_socket.setblocking(0)
-        logger.info('[control] Connection established')
-        return nav_socket, control_socket
+    def __new__(cls,pix_fmt='rgb24',size=None,crop=None,source=(640,360)):
+        assert pix_fmt in cls.PIX_FMTS, pix_fmt
+        return super(OutputSpec,cls).__new__(cls,pix_fmt,size,crop,source)
 
-    def _disconnect(nav_socket, control_socket):
-        logger.info('[control] Disconnecting from AR Drone')
-        nav_socket.close()
-        control_socket.close()
+    @property
+    def dimensions(self):
+        """(width, height) of the images."""
+        w, h = self.source if self.crop is None else self.crop[2:]
+        if self.size is None: return w, h
+        if isinstance(self.size,(int,float)): return int(w*self.size)//2*2, int(h*self.size)//2*2
+        return tuple(self.size)
+
+    @property
+    def shape(self):
+        """Shape of the images (of the planes, for yuv420p)."""
+        w, h = self.dimensions
+        if self.pix_fmt == 'rgb24': return (h,w,3)
+        if self.pix_fmt == 'gray': return (h,w)
+        return Planes((h,w),(h//2,w//2),(h//2,w//2))
 
-    nav_socket, control_socket = _connect()
+    @property
+    def frame_size(self):
+        """Size in bytes of an image."""
+        w, h = self.dimensions
+        return w*h*3 if self.pix_fmt == 'rgb24' else w*h if self.pix_fmt == 'gray' else w*h+2*(w//2)*(h//2)
 
-    connection_lost = 0
+    def ffmpeg_args(self):
+        """Returns the ffmpeg output options producing these images."""
+        filters = []
+        if self.crop is not None: filters.append('crop={2}:{3}:{0}:{1}'.format(*self.crop))
+        if self.size is not None: filters.append('scale={}:{}'.format(*self.dimensions))
+        return (('-vf',','.join(filters)) if filters else ())+('-pix_fmt',self.pix_fmt)
+
+    def allocate(self,buffer=None):
+        """Returns a new image, in the memory of *buffer* (a uint8 array of :attr:`frame_size` elements) if not None, and a byte view of its memory."""
+        if buffer is None: buffer = numpy.zeros(self.frame_size,dtype='uint8')
+        shape = self.shape
+        if self.pix_fmt != 'yuv420p': return buffer.reshape(shape), memoryview(buffer)
+        y, u = shape.y[0]*shape.y[1], shape.u[0]*shape.u[1]
+        return Planes(buffer[:y].reshape(shape.y),buffer[y:y+u].reshape(shape.u),buffer[y+u:].reshape(shape.v)), memoryview(buffer)
+
+class FramePool (object):
+    """
+An instance of this class holds *size* preallocated images of format *output* (an :class:`OutputSpec`), reused in turn by the video decoding loop, so that no memory is allocated per frame. An image published by the loop is overwritten *size* frames later: consumers which need to keep it longer must copy it. If *ring* (a :class:`framering.FrameRing`) is not None, the images are its slots, so that the images are decoded straight into the shared memory.
+    """
+    def __init__(self,output,size=3,ring=None):
+        self.ring = ring
+        if ring is None: self.images, self.buffers = zip(*[output.allocate() for _ in range(size)])
+        else: self.images, self.buffers = ring.images, ring.buffers
+        assert len(self.images) >= 3
+        self.index = 0
+    def next(self):
+        """Returns the next image of the pool and a byte view of it."""
+        i = self.index
+        self.index = (i+1)%len(self.images)
+        if self.ring is not None: self.ring.acquire(i)
+        return self.images[i], self.buffers[i]
+
+#==================================================================================================
+def ctrlreplay(drone,main,video):
+#==================================================================================================
+    if not video:
+        return (threading.Thread(target=replay_process,args=(drone.replay,None,drone,main)),)
+    sink, threads = drone.decoder.open(drone,main)
+    return [threading.Thread(target=replay_process,args=(drone.replay,sink,drone,main))]+threads
+
+def replay_process(replay,pipe,drone,main):
+    """Feeds the navdata and video chunks played by *replay* (a :class:`recording.Replay`) to the same consumers as the sockets of a drone."""
+    link = navlink(drone,main)
+    tracer = drone.tracer
+    parser = None if pipe is None else paveparser.PaVERingParser(pipe,tracer=tracer)
+    try:
+        logger.info('[replay_process] Starting loop')
+        for kind, timestamp, data in replay.play():
+            if not main.running: break
+            if kind == NAVDATA:
+                link.on_packet(bytes(data)) # the records keep the packet: not a view of the replay
+            elif kind == VIDEO and parser is not None:
+                if tracer is not None: tracer.recv = time.perf_counter()
+                parser.write(data)
+            elif kind == SEEK and parser is not None:
+                parser = paveparser.PaVERingParser(pipe,tracer=tracer)
+    finally:
+        logger.info('[replay_process] Stopping loop')
+        if pipe is not None: pipe.close()
+
+#==================================================================================================
+class FrameTrace (object):
+    """
+The trace of a video frame through the pipeline: its PaVE *frame_number* and *pave_timestamp* (in ms, drone clock), and the :func:`time.perf_counter` times of the stages: *recv* (reception of its header), *parsed* (header indexed), *written* (payload passed to the decoder), *decoded* (image out of the decoder) and *published* (:meth:`libardrone.ARDrone.set_image`).
+    """
+#==================================================================================================
+    __slots__ = ('frame_number','pave_timestamp','recv','parsed','written','decoded','published')
+
+    def __init__(self,frame_number,pave_timestamp,recv,parsed):
+        self.frame_number = frame_number
+        self.pave_timestamp = pave_timestamp
+        self.recv = recv
+        self.parsed = parsed
+        self.written = self.decoded = self.published = None
+
+    def __repr__(self):
+        return 'FrameTrace({})'.format(', '.join('{}={}'.format(k,getattr(self,k)) for k in self.__slots__))
+
+#==================================================================================================
+class FrameTracer (object):
+    """
+An instance of this class collects the :class:`FrameTrace` of the video frames, fed by :class:`paveparser.PaVERingParser` (methods :meth:`parsed` and :meth:`written`), :func:`video_parse` (attribute :attr:`recv`), the decoder backend (method :meth:`decoded`) and :meth:`libardrone.ARDrone.set_image` (method :meth:`published`). The decoder outputs the images in the order of the payloads (there are no B-frames), so a decoded image is matched with the oldest payload written and not yet decoded.
+
+The latencies of the stages of the last *window* frames are kept for :meth:`stats` and :meth:`histogram`. The stages are ``parse`` (recv to parsed), ``write``, ``decode``, ``publish`` and ``total`` (recv to published). The startup delay of the decoder, from the first payload written to the first image decoded, is kept in :attr:`first_frame` (in seconds, None until then).
+    """
+#==================================================================================================
+
+    STAGES = (('parse','recv','parsed'),('write','parsed','written'),('decode','written','decoded'),('publish','decoded','published'),('total','recv','published'))
+
+    def __init__(self,window=1024):
+        self.recv = None # time of the last recv of the video socket
+        self.traces = dict() # traces of the frames indexed, by frame number, in order
+        self.pending = deque() # traces of the frames written to the decoder, not decoded yet
+        self.latencies = numpy.zeros((len(self.STAGES),window))
+        self.count = 0
+        self.last = None # last published trace
+        self.first_written = None # time of the first payload written to the decoder
+        self.first_frame = None
+
+    def parsed(self,frame):
+        self.traces[frame.frame_number] = FrameTrace(frame.frame_number,frame.timestamp,self.recv,time.perf_counter())
+
+    def written(self,frame):
+        t = time.perf_counter()
+        traces = self.traces
+        while traces: # the frames indexed before this one have been dropped
+            n = next(iter(traces))
+            trace = traces.pop(n)
+            if n == frame.frame_number:
+                trace.written = t
+                if self.first_written is None: self.first_written = t
+                self.pending.append(trace)
+                break
+
+    def decoded(self):
+        """Returns the trace of the image just decoded (None if unknown)."""
+        t = time.perf_counter()
+        if self.first_frame is None and self.first_written is not None: self.first_frame = t-self.first_written
+        try: trace = self.pending.popleft()
+        except IndexError: return None
+        trace.decoded = t
+        return trace
+
+    def published(self,trace):
+        trace.published = time.perf_counter()
+        i = self.count % self.latencies.shape[1]
+        for k,(_,start,stop) in enumerate(self.STAGES):
+            self.latencies[k,i] = getattr(trace,stop)-getattr(trace,start)
+        self.count += 1
+        self.last = trace
+
+    def window(self):
+        """Returns the array of the latencies (in seconds) of the last frames, one row per stage."""
+        return self.latencies[:,:min(self.count,self.latencies.shape[1])]
+
+    def stats(self):
+        """Returns a dict of the statistics (in ms) of the latencies of each stage over the last frames."""
+        x = self.window()*1e3
+        if not x.shape[1]: return dict()
+        p50, p99 = numpy.percentile(x,(50,99),axis=1)
+        return dict((name,dict(p50=float(p50[k]),p99=float(p99[k]),mean=float(x[k].mean()),max=float(x[k].max()))) for k,(name,_,_) in enumerate(self.STAGES))
+
+    def histogram(self,stage,bins=20):
+        """Returns the histogram (as :func:`numpy.histogram`, in ms) of the latencies of *stage* over the last frames."""
+        k = [name for name,_,_ in self.STAGES].index(stage)
+        return numpy.histogram(self.window()[k]*1e3,bins)
+
+#==================================================================================================
+def ctrlnavdata(drone,main):
+#==================================================================================================
+    link = main.navlink = navlink(drone,main)
+    if drone.reactor is not None:
+        link.attach(drone.reactor)
+        return ()
+    t = threading.Thread(target=navdata_process,args=(link,main))
+    return (t,)
+
+def navdata_process(link,main):
+    link.connect()
     reconnection_needed = False
     logger.info('[navdata_process] Starting loop')
     while main.running:
         if reconnection_needed:
-            _disconnect(nav_socket, control_socket)
-            nav_socket, control_socket = _connect()
+            link.reconnect()
             reconnection_needed = False
-        inputready, outputready, exceptready = select.select([nav_socket, control_socket], [], [], 1.)
+        inputready, outputready, exceptready = select.select(link.sockets(), [], [], 1.)
         if len(inputready) == 0:
-            connection_lost += 1
             reconnection_needed = True
             continue
         for i in inputready:
-            if i == nav_socket:
-                while True:
-                    try: data = nav_socket.recv(500)
-                    except IOError: break
-                navdata, has_information = navdata_decode(data)
-                if has_information: drone.set_navdata(navdata)
-            elif i == control_socket:
-                while True:
-                    try:
-                        data = control_socket.recv(65535)
-                        if len(data) == 0:
-                            logger.warning('[control] Received an empty packet on control socket')
-                            reconnection_needed = True
-                            break
-                        else:
-                            logger.warning('[control] %s', data)
-                    except IOError:
-                        break
+            if i is link.nav_socket: link.on_navdata()
+            elif not link.on_control(): reconnection_needed = True
     logger.info('[navdata_process] Stopping loop')
-    _disconnect(nav_socket, control_socket)
-
-def navdata_decode(packet):
-    """Decode a navdata packet."""
-    offset = 0
-    _ = struct.unpack_from("IIII", packet, offset)
-    drone_state = dict()
-    drone_state['fly_mask'] = _[1] & 1 # FLY MASK : (0) ardrone is landed, (1) ardrone is flying
-    drone_state['video_mask'] = _[1] >> 1 & 1 # VIDEO MASK : (0) video disable, (1) video enable
-    drone_state['vision_mask'] = _[1] >> 2 & 1 # VISION MASK : (0) vision disable, (1) vision enable */
-    drone_state['control_mask'] = _[1] >> 3 & 1 # CONTROL ALGO (0) euler angles control, (1) angular speed control */
-    drone_state['altitude_mask'] = _[1] >> 4 & 1 # ALTITUDE CONTROL ALGO : (0) altitude control inactive (1) altitude control active */
-    drone_state['user_feedback_start'] = _[1] >> 5 & 1 # USER feedback : Start button state */
-    drone_state['command_mask'] = _[1] >> 6 & 1 # Control command ACK : (0) None, (1) one received */
-    drone_state['fw_file_mask'] = _[1] >> 7 & 1 # Firmware file is good (1) */
-    drone_state['fw_ver_mask'] = _[1] >> 8 & 1 # Firmware update is newer (1) */
-    drone_state['fw_upd_mask'] = _[1] >> 9 & 1 # Firmware update is ongoing (1) */
-    drone_state['navdata_demo_mask'] = _[1] >> 10 & 1 # Navdata demo : (0) All navdata, (1) only navdata demo */
-    drone_state['navdata_bootstrap'] = _[1] >> 11 & 1 # Navdata bootstrap : (0) options sent in all or demo mode, (1) no navdata options sent */
-    drone_state['motors_mask'] = _[1] >> 12 & 1 # Motor status : (0) Ok, (1) Motors problem */
-    drone_state['com_lost_mask'] = _[1] >> 13 & 1 # Communication lost : (1) com problem, (0) Com is ok */
-    drone_state['vbat_low'] = _[1] >> 15 & 1 # VBat low : (1) too low, (0) Ok */
-    drone_state['user_el'] = _[1] >> 16 & 1 # User Emergency Landing : (1) User EL is ON, (0) User EL is OFF*/
-    drone_state['timer_elapsed'] = _[1] >> 17 & 1 # Timer elapsed : (1) elapsed, (0) not elapsed */
-    drone_state['angles_out_of_range'] = _[1] >> 19 & 1 # Angles : (0) Ok, (1) out of range */
-    drone_state['ultrasound_mask'] = _[1] >> 21 & 1 # Ultrasonic sensor : (0) Ok, (1) deaf */
-    drone_state['cutout_mask'] = _[1] >> 22 & 1 # Cutout system detection : (0) Not detected, (1) detected */
-    drone_state['pic_version_mask'] = _[1] >> 23 & 1 # PIC Version number OK : (0) a bad version number, (1) version number is OK */
-    drone_state['atcodec_thread_on'] = _[1] >> 24 & 1 # ATCodec thread ON : (0) thread OFF (1) thread ON */
-    drone_state['navdata_thread_on'] = _[1] >> 25 & 1 # Navdata thread ON : (0) thread OFF (1) thread ON */
-    drone_state['video_thread_on'] = _[1] >> 26 & 1 # Video thread ON : (0) thread OFF (1) thread ON */
-    drone_state['acq_thread_on'] = _[1] >> 27 & 1 # Acquisition thread ON : (0) thread OFF (1) thread ON */
-    drone_state['ctrl_watchdog_mask'] = _[1] >> 28 & 1 # CTRL watchdog : (1) delay in control execution (> 5ms), (0) control is well scheduled */
-    drone_state['adc_watchdog_mask'] = _[1] >> 29 & 1 # ADC Watchdog : (1) delay in uart2 dsr (> 5ms), (0) uart2 is good */
-    drone_state['com_watchdog_mask'] = _[1] >> 30 & 1 # Communication Watchdog : (1) com problem, (0) Com is ok */
-    drone_state['emergency_mask'] = _[1] >> 31 & 1 # Emergency landing : (0) no emergency, (1) emergency */
-    data = dict()
-    data['drone_state'] = drone_state
-    data['header'] = _[0]
-    data['seq_nr'] = _[2]
-    data['vision_flag'] = _[3]
-    offset += struct.calcsize("IIII")
-    has_flying_information = False
-    while True:
-        try:
-            id_nr, size = struct.unpack_from("HH", packet, offset)
-            offset += struct.calcsize("HH")
-        except struct.error:
-            break
-        values = []
-        for i in range(size - struct.calcsize("HH")):
-            values.append(struct.unpack_from("c", packet, offset)[0])
-            offset += struct.calcsize("c")
-        # navdata_tag_t in navdata-common.h
-        if id_nr == 0:
-            has_flying_information = True
-            values = struct.unpack_from("IIfffifffI", "".join(values))
-            values = dict(zip(['ctrl_state', 'battery', 'theta', 'phi', 'psi', 'altitude', 'vx', 'vy', 'vz', 'num_frames'], values))
-            # convert the millidegrees into degrees and round to int, as they
-            # are not so precise anyways
-            for i in 'theta', 'phi', 'psi':
-                values[i] = int(values[i] / 1000)
-        data[id_nr] = values
-    return data, has_flying_information
+    link.disconnect()
+
+#==================================================================================================
+class navlink (object):
+#==================================================================================================
+    """
+An instance of this class manages the navdata and control connections of *drone*, and publishes the received navdata to it. The sockets are either polled by :func:`navdata_process` in a dedicated thread, or registered in a reactor shared by several drones (see :class:`fleet.Reactor`), in which case the connections are reset when no navdata arrives for one second.
+    """
+
+    def __init__(self,drone,main):
+        self.drone = drone
+        self.main = main
+        self.host = drone.host
+        self.ports = drone.ports
+        self.nav_socket = None
+        self.control_socket = None
+        self.reactor = None
+        self.received = 0
+        self.checked = 0
+
+    def connect(self):
+        self.nav_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.nav_socket.setblocking(0)
+        self.nav_socket.bind(('', self.ports['navdata_client']))
+        self.nav_socket.sendto(b"\x01\x00\x00\x00", (self.host, self.ports['navdata']))
+        self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.control_socket.setblocking(0) # a failed connection shows as a read error (see on_control)
+        self.control_socket.connect_ex((self.host, self.ports['control']))
+        if self.reactor is not None:
+            self.reactor.register(self.nav_socket, self.on_navdata)
+            self.reactor.register(self.control_socket, self.on_control_event)
+        logger.info('[control] Connection established')
+
+    def disconnect(self):
+        logger.info('[control] Disconnecting from AR Drone')
+        for s in self.sockets():
+            if self.reactor is not None: self.reactor.unregister(s)
+            s.close()
+        self.nav_socket = self.control_socket = None
+
+    def reconnect(self):
+        self.disconnect()
+        self.connect()
+
+    def sockets(self):
+        return [s for s in (self.nav_socket, self.control_socket) if s is not None]
+
+    def on_navdata(self):
+        recorder = self.drone.recorder
+        while True:
+            try: data = self.nav_socket.recv(NAVDATA_MAX_SIZE)
+            except IOError: break
+            if recorder is not None: recorder.navdata(data)
+            self.on_packet(data)
+
+    def on_packet(self,data):
+        self.received += 1
+        if len(data) < NAVDATA_HEADER_SIZE: return
+        self.drone.set_drone_state(drone_state_word(data))
+        navdata, has_information = navdata_decode(data)
+        if has_information: self.drone.set_navdata(navdata)
+
+    def on_control(self):
+        """Reads the control socket. Returns False if the connection is closed by the drone."""
+        while True:
+            try:
+                data = self.control_socket.recv(65535)
+                if len(data) == 0:
+                    logger.warning('[control] Received an empty packet on control socket')
+                    return False
+                else:
+                    self.drone.set_control(data)
+            except BlockingIOError:
+                return True
+            except IOError as e: # connection failed: do without it until the next reconnection
+                logger.warning('[control] %s', e)
+                if self.reactor is not None: self.reactor.unregister(self.control_socket)
+                self.control_socket.close()
+                self.control_socket = None
+                return True
+
+    #----------------------------------------------------------------------------------------------
+    # Reactor mode
+    #----------------------------------------------------------------------------------------------
+
+    def attach(self,reactor):
+        self.reactor = reactor
+        reactor.call_soon(self.connect)
+        reactor.call_later(1., self.watchdog)
+
+    def on_control_event(self):
+        if not self.on_control(): self.reconnect()
+
+    def watchdog(self):
+        if not self.main.running:
+            self.disconnect()
+            return
+        if self.received == self.checked: self.reconnect()
+        self.checked = self.received
+        self.reactor.call_later(1., self.watchdog)
@@ -0,0 +1,759 @@
+"""
+Benchmarks of the hot paths of the package, on synthetic data and against drones simulated on the local host (no drone needed). Run as::
+
+  python benchmark.py [--quick] [--json FILE] [NAME ...]
+
+where the NAMEs are prefixes of the benchmarks to run (all by default). The results are printed and, with ``--json``, written along with the Python version, platform and git commit, to compare them across commits.
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import socket
+import resource
+import platform
+import selectors
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import numpy
+
+import paveparser
+import libardrone
+import arnetwork
+import navdata
+import fleet
+import simulator
+import recording
+import framering
+from analysis import AnalysisPool
+
+#==================================================================================================
+# Suite
+#==================================================================================================
+
+BENCHMARKS = [] # (name, function) in order of execution
+QUICK = False # shorter runs (set by --quick)
+
+def benchmark(name):
+    """Registers the decorated function as benchmark *name*. It returns a dict of results (numbers or strings)."""
+    def register(f):
+        BENCHMARKS.append((name, f))
+        return f
+    return register
+
+def best_rate(f, n, repeat=3):
+    """Returns the best rate (calls/sec) over *repeat* runs of *n* calls of *f* (called with the call index)."""
+    best = 0.
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for i in range(n): f(i)
+        best = max(best, n / (time.perf_counter() - t))
+    return best
+
+def distribution(values, scale=1e3):
+    """Returns a dict of statistics of *values* (seconds, in ms by default)."""
+    if not len(values): return dict(count=0)
+    x = numpy.asarray(values) * scale
+    return dict(count=len(x), mean=float(x.mean()), p50=float(numpy.percentile(x, 50)), p99=float(numpy.percentile(x, 99)), max=float(x.max()))
+
+def git_commit():
+    try: return subprocess.check_output(('git', 'rev-parse', 'HEAD'), cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+def run(prefixes=()):
+    """Runs the benchmarks whose name starts with one of *prefixes* (all if empty), prints their results, and returns them with the description of the environment."""
+    results = {}
+    for name, f in BENCHMARKS:
+        if prefixes and not any(name.startswith(p) for p in prefixes): continue
+        r = results[name] = f()
+        print('{}: {}'.format(name, ', '.join('{}={}'.format(k, '{:.4g}'.format(v) if isinstance(v, float) else v) for k, v in r.items())))
+        sys.stdout.flush()
+    return dict(
+      commit=git_commit(),
+      date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+      python=platform.python_version(),
+      numpy=numpy.__version__,
+      platform=platform.platform(),
+      machine=platform.machine(),
+      cpus=os.cpu_count(),
+      quick=QUICK,
+      results=results,
+      )
+
+#==================================================================================================
+# Synthetic data
+#==================================================================================================
+
+# (width, height, bitrate in kbit/s) of the streams of the drone
+PAVE_PROFILES = {
+  '360p': (640, 360, 1000),
+  '720p': (1280, 720, 4000),
+  }
+
+def pave_stream(width, height, bitrate, fps=30, gop=30, seconds=10., seed=0):
+    """
+Returns a synthetic PaVE stream (:class:`bytes`) at *bitrate* kbit/s, with an I-frame every *gop* frames, 5 times bigger than the P-frames. The payloads are random bytes, so they may contain spurious PaVE signatures as in a real stream.
+    """
+    rnd = random.Random(seed)
+    nframes = int(seconds * fps)
+    psize = int(bitrate * 125 * gop / (fps * (gop + 4)))
+    chunks = []
+    for n in range(nframes):
+        frame_type = 1 if n % gop == 0 else 3
+        size = 5 * psize if frame_type == 1 else psize
+        chunks.append(simulator.pave_header(width, height, n, int(n * 1000 / fps), frame_type, size))
+        chunks.append(bytes(rnd.getrandbits(8) for _ in range(64)) * (size // 64) + bytes(size % 64))
+    return b''.join(chunks)
+
+def recv_chunks(data, maxsize=65536, seed=0):
+    """Splits *data* as successive calls to :meth:`socket.recv` would, with sizes up to *maxsize*."""
+    rnd = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < len(data):
+        n = rnd.randint(maxsize // 8, maxsize)
+        chunks.append(data[i:i + n])
+        i += n
+    return chunks
+
+class nullsink(object):
+    def __init__(self):
+        self.written = 0
+    def write(self, data):
+        self.written += len(data)
+
+#==================================================================================================
+# Navdata decoding
+#==================================================================================================
+
+@benchmark('navdata_decode.demo')
+def bench_navdata_demo():
+    packet = simulator.navdata_packet(1, demo=dict(battery=80, altitude=1000))
+    rate = best_rate(lambda i: navdata.navdata_decode(packet), 20000 if QUICK else 100000)
+    return dict(packets_per_s=rate, us_per_packet=1e6 / rate, size=len(packet))
+
+@benchmark('navdata_decode.full')
+def bench_navdata_full():
+    packet = simulator.navdata_packet(1, demo=dict(battery=80, altitude=1000), full=True)
+    rate = best_rate(lambda i: navdata.navdata_decode(packet), 5000 if QUICK else 20000)
+    return dict(packets_per_s=rate, us_per_packet=1e6 / rate, size=len(packet))
+
+@benchmark('navdata_decode.retention')
+def bench_navdata_retention():
+    """Decoding time and memory of 3 minutes of full navdata at 200 Hz, kept as :class:`navdata.Navdata` records or as dicts, the consumer reading the altitude and battery of each packet."""
+    import tracemalloc
+    n = 200 * (30 if QUICK else 180)
+    base = simulator.navdata_packet(0, demo=dict(battery=80, altitude=1000), full=True)
+    # as bytearrays, so that each packet is a new bytes object, as received from the socket
+    packets = [bytearray(navdata.HEADER.pack(navdata.NAVDATA_HEADER, 0, i, 0) + base[navdata.HEADER.size:]) for i in range(n)]
+    def retain(decode):
+        kept = []
+        for p in packets:
+            data, _ = decode(bytes(p))
+            data[0]['altitude'], data[0]['battery']
+            kept.append(data)
+        return kept
+    r = dict(packets=n)
+    for name, decode in ('records', navdata.navdata_decode), ('dicts', navdata.navdata_decode_dict):
+        t = time.perf_counter()
+        kept = retain(decode)
+        r[name + '_packets_per_s'] = n / (time.perf_counter() - t)
+        del kept
+        tracemalloc.start()
+        kept = retain(decode)
+        r[name + '_MB'] = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        del kept
+    return r
+
+@benchmark('navdata_decode_batch.demo')
+def bench_navdata_batch():
+    n = 100000 if QUICK else 1000000
+    packets = simulator.navdata_packet(1) * n
+    size = len(packets) // n
+    offsets = numpy.arange(0, len(packets), size)
+    t = time.perf_counter()
+    navdata.navdata_decode_batch(packets, offsets)
+    return dict(packets_per_s=n / (time.perf_counter() - t))
+
+#==================================================================================================
+# PaVE parsing
+#==================================================================================================
+
+def misaligned_stream(data, every=10, seed=0):
+    """Returns *data* starting in the middle of its first frame, with junk inserted after every *every* recv chunks."""
+    rnd = random.Random(seed)
+    chunks = recv_chunks(data[1000:])
+    for i in range(every, len(chunks), every):
+        chunks[i] = bytes(rnd.getrandbits(8) for _ in range(500)) + chunks[i]
+    return chunks
+
+def bench_paveparser(parser, chunks):
+    """Returns the throughput in bytes/sec of *parser* on the list of recv *chunks*."""
+    t = time.perf_counter()
+    for c in chunks:
+        parser.write(c)
+    t = time.perf_counter() - t
+    return sum(map(len, chunks)) / t
+
+def paveparser_scenarios(profile):
+    data = pave_stream(*PAVE_PROFILES[profile], seconds=3. if QUICK else 10.)
+    def aligned():
+        return dict(
+          PaVEParser=bench_paveparser(paveparser.PaVEParser(nullsink()), recv_chunks(data)),
+          PaVERingParser=bench_paveparser(paveparser.PaVERingParser(nullsink(), policy=paveparser.NeverDrop()), recv_chunks(data)),
+          )
+    def misaligned():
+        parser = paveparser.PaVERingParser(nullsink(), policy=paveparser.NeverDrop())
+        return dict(
+          PaVEParser=bench_paveparser(paveparser.PaVEParser(nullsink()), misaligned_stream(data)),
+          PaVERingParser=bench_paveparser(parser, misaligned_stream(data)),
+          misaligned_frames=parser.misaligned_frames,
+          )
+    def dropping():
+        r = dict(PaVEParser=bench_paveparser(paveparser.PaVEParser(nullsink()), recv_chunks(data)))
+        for policy in paveparser.LatestIFrame(), paveparser.NewestFrame(), paveparser.BoundedLatency(100):
+            name = type(policy).__name__
+            r[name] = bench_paveparser(paveparser.PaVERingParser(nullsink(), policy=policy), recv_chunks(data))
+            r[name + '_dropped'] = policy.dropped_iframes + policy.dropped_pframes
+        return r
+    for f in aligned, misaligned, dropping:
+        benchmark('paveparser.{}.{}'.format(profile, f.__name__))(f)
+
+for profile in sorted(PAVE_PROFILES): paveparser_scenarios(profile)
+
+#==================================================================================================
+# AT commands
+#==================================================================================================
+
+AT_COMMANDS = {
+  'pcmd': (
+    lambda seq: libardrone.at('PCMD', seq, [1, 0.2, 0., -0.2, 0.]),
+    lambda seq: libardrone.at_pcmd(seq, True, 0.2, 0., -0.2, 0.),
+    ),
+  'ref': (
+    lambda seq: libardrone.at('REF', seq, [0b10001010101000000000000000000]),
+    lambda seq: libardrone.at_ref(seq, False),
+    ),
+  'config': (
+    lambda seq: libardrone.at('CONFIG', seq, ['video:bitrate', '500']),
+    lambda seq: libardrone.at_config(seq, 'video:bitrate', '500'),
+    ),
+  }
+
+def at_scenario(name):
+    generic, specific = AT_COMMANDS[name]
+    def encode():
+        n = 20000 if QUICK else 100000
+        return dict(at=best_rate(generic, n), specific=best_rate(specific, n))
+    benchmark('at.encode.' + name)(encode)
+
+for name in sorted(AT_COMMANDS): at_scenario(name)
+
+@benchmark('at.send')
+def bench_at_send():
+    """
+Commands/sec queued in an :class:`libardrone.ATChannel` to a local socket, up to their transmission, and the datagrams and bytes sent and received: UDP drops the datagrams which overflow the receive buffer, so the loss tells whether the sending rate holds for the receiver.
+    """
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sink.settimeout(.2)
+    received = [0, 0] # datagrams, bytes
+    def drain():
+        while True:
+            try: data = sink.recv(65536)
+            except socket.timeout: break
+            received[0] += 1
+            received[1] += len(data)
+    t = threading.Thread(target=drain)
+    t.start()
+    channel = libardrone.ATChannel(sink.getsockname())
+    n = 20000 if QUICK else 100000
+    sent = 0
+    start = time.perf_counter()
+    for seq in range(n):
+        c = libardrone.at_pcmd(seq, True, 0.2, 0., -0.2, 0.)
+        channel.send(c)
+        sent += len(c)
+    channel.close()
+    elapsed = time.perf_counter() - start
+    t.join()
+    sink.close()
+    return dict(commands_per_s=n / elapsed, commands_per_datagram=channel.commands_sent / channel.datagrams_sent,
+      datagrams_sent=channel.datagrams_sent, datagrams_received=received[0], bytes_sent=sent, bytes_received=received[1],
+      loss_rate=1 - received[1] / sent)
+
+#==================================================================================================
+# Video frame reading
+#==================================================================================================
+
+class framecounter(object):
+    """Receives the frames of :func:`arnetwork.video_process` in place of a drone."""
+    def __init__(self, output):
+        self.output = output
+        self.image = output.allocate()[0]
+        self.frames = 0
+        self.running = True
+        self.tracer = None
+        self.frame_ring = None
+    def set_image(self, image, seq, timestamp):
+        self.frames = seq
+
+@benchmark('video_process')
+def bench_video_process():
+    """Frames/sec read by :func:`arnetwork.video_process` from the pipe of a process writing raw 360p frames."""
+    output = arnetwork.OutputSpec()
+    n = 300 if QUICK else 1500
+    writer = 'import sys\nx = bytes({})\nfor _ in range({}): sys.stdout.buffer.write(x)'.format(output.frame_size, n)
+    sub = subprocess.Popen((sys.executable, '-c', writer), stdout=subprocess.PIPE, bufsize=0)
+    drone = framecounter(output)
+    t = time.perf_counter()
+    arnetwork.video_process(sub.stdout, sub, drone, drone)
+    t = time.perf_counter() - t
+    sub.wait()
+    return dict(frames_per_s=drone.frames / t, MB_per_s=drone.frames * output.frame_size / t / 1e6, frames=drone.frames)
+
+OUTPUT_SPECS = {
+  'rgb24': arnetwork.OutputSpec(),
+  'gray': arnetwork.OutputSpec('gray'),
+  'gray.half': arnetwork.OutputSpec('gray', size=.5),
+  'yuv420p': arnetwork.OutputSpec('yuv420p'),
+  'rgb24.crop': arnetwork.OutputSpec(crop=(160, 90, 320, 180)),
+}
+
+def feed(pipe, data, chunk=65536):
+    try:
+        for i in range(0, len(data), chunk): pipe.write(data[i:i + chunk])
+    except (BrokenPipeError, ValueError): pass
+    finally: pipe.close()
+
+def output_scenario(name):
+    output = OUTPUT_SPECS[name]
+    @benchmark('video_output.' + name)
+    def bench_video_output():
+        """Frames/sec and CPU (of this process and of ffmpeg) of the decoding of a 360p H.264 clip by :func:`arnetwork.video_process` into images of a given :class:`arnetwork.OutputSpec`."""
+        ffmpeg = ffmpeg_path()
+        r = dict(bytes_per_frame=output.frame_size, shape=str(output.shape))
+        if ffmpeg is None:
+            r.update(skipped='ffmpeg not found')
+            return r
+        data = h264_clip(ffmpeg, 5 if QUICK else 20)
+        FFMPEG = libardrone.FFMPEG
+        libardrone.FFMPEG = ffmpeg
+        try:
+            sub = subprocess.Popen(arnetwork.ffmpeg_command(output), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        finally:
+            libardrone.FFMPEG = FFMPEG
+        drone = framecounter(output)
+        writer = threading.Thread(target=feed, args=(sub.stdin, data))
+        cpu, children = time.process_time(), resource.getrusage(resource.RUSAGE_CHILDREN)
+        t = time.perf_counter()
+        writer.start()
+        arnetwork.video_process(sub.stdout, sub, drone, drone)
+        sub.wait()
+        t = time.perf_counter() - t
+        writer.join()
+        cpu, after = time.process_time() - cpu, resource.getrusage(resource.RUSAGE_CHILDREN)
+        ffmpeg_cpu = after.ru_utime + after.ru_stime - children.ru_utime - children.ru_stime
+        r.update(frames_per_s=drone.frames / t, frames=drone.frames, cpu_ms_per_frame=cpu / drone.frames * 1e3, ffmpeg_cpu_ms_per_frame=ffmpeg_cpu / drone.frames * 1e3)
+        return r
+
+for name in OUTPUT_SPECS: output_scenario(name)
+
+#==================================================================================================
+# Replay
+#==================================================================================================
+
+@benchmark('replay')
+def bench_replay():
+    """Throughput of the offline pipeline: a recording played as fast as possible into the PaVE parser and the navdata decoder."""
+    fd, filename = tempfile.mkstemp(suffix='.ardrone')
+    os.close(fd)
+    try:
+        recorder = recording.Recorder(filename)
+        chunks = recv_chunks(pave_stream(*PAVE_PROFILES['360p'], seconds=10. if QUICK else 60.))
+        packet = simulator.navdata_packet(1)
+        for i, c in enumerate(chunks):
+            recorder.video(c, i * .01)
+            recorder.navdata(packet, i * .01)
+        recorder.close()
+        t = time.perf_counter()
+        replay = recording.Replay(filename, speed=None)
+        opened = time.perf_counter() - t
+        parser = paveparser.PaVERingParser(nullsink(), policy=paveparser.NeverDrop())
+        size = 0
+        t = time.perf_counter()
+        for kind, timestamp, data in replay.play():
+            if kind == recording.VIDEO:
+                parser.write(data)
+                size += len(data)
+            else:
+                navdata.navdata_decode(data)
+        t = time.perf_counter() - t
+        n = len(replay)
+        del data # a view of the mapped file
+        replay.close()
+    finally:
+        os.remove(filename)
+    return dict(chunks_per_s=n / t, MB_per_s=size / t / 1e6, frames=parser.payloads, open_ms=opened * 1e3)
+
+#==================================================================================================
+# End to end, against simulated drones
+#==================================================================================================
+
+SIMULATOR_PORTS = dict(navdata=48000, video=48001, command=48002, control=48005)
+
+def simulated(video=None, trace=False, **kwargs):
+    """Returns a started :class:`simulator.Simulator` (streaming the H.264 file *video*, if not None) and an :class:`libardrone.ARDrone` connected to it, decoding the video if any."""
+    sim = simulator.Simulator(ports=SIMULATOR_PORTS, video=video, **kwargs).start()
+    try: drone = libardrone.ARDrone(host='127.0.0.1', ports=dict(SIMULATOR_PORTS, navdata_client=0), video=video is not None, trace=trace)
+    except Exception:
+        sim.stop()
+        raise
+    return sim, drone
+
+@benchmark('e2e.command_latency')
+def bench_command_latency():
+    """Delay between :meth:`libardrone.ARDrone.at` and the reception of the command by the simulator."""
+    sim, drone = simulated()
+    try:
+        sent = []
+        for i in range(100 if QUICK else 500):
+            sent.append(time.perf_counter())
+            drone.at(libardrone.at_config, 'custom:benchmark', str(i))
+            time.sleep(.005)
+        time.sleep(.1)
+    finally:
+        drone.halt()
+        sim.stop()
+    latency = [t - sent[int(args[1])] for t, name, seq, args in sim.log if name == 'CONFIG' and args[0] == 'custom:benchmark']
+    r = distribution(latency)
+    r.update(lost=len(sent) - len(latency), window_ms=drone.channel.window * 1e3)
+    return r
+
+@benchmark('e2e.navdata')
+def bench_navdata():
+    """Navdata samples/sec received and decoded from the simulator in full mode (200 Hz, all options)."""
+    sim, drone = simulated()
+    try:
+        drone.config({'general:navdata_demo': False})
+        time.sleep(1.)
+        seq, sent = drone.navdata_sample.seq, sim.navdata_sent
+        t = time.perf_counter()
+        time.sleep(2. if QUICK else 5.)
+        t = time.perf_counter() - t
+        received, sent = drone.navdata_sample.seq - seq, sim.navdata_sent - sent
+    finally:
+        drone.halt()
+        sim.stop()
+    return dict(samples_per_s=received / t, lost=max(sent - received, 0), options=len([k for k in drone.navdata if isinstance(k, int)]))
+
+def ffmpeg_path():
+    if libardrone.FFMPEG is not None and os.path.exists(libardrone.FFMPEG): return libardrone.FFMPEG
+    return shutil.which('ffmpeg' if libardrone.FFMPEG is None else os.path.basename(libardrone.FFMPEG)) or shutil.which('ffmpeg')
+
+@benchmark('e2e.frame_latency')
+def bench_frame_latency():
+    """Delay between the sending of a frame by the simulator and its publication as a numpy image (PaVE parsing, ffmpeg decoding and reading)."""
+    ffmpeg = ffmpeg_path()
+    if ffmpeg is None: return dict(skipped='ffmpeg not found')
+    fd, video = tempfile.mkstemp(suffix='.h264')
+    os.close(fd)
+    FFMPEG = libardrone.FFMPEG
+    try:
+        subprocess.check_call((ffmpeg, '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=30', '-t', '10',
+          '-c:v', 'libx264', '-bf', '0', '-g', '30', '-f', 'h264', video))
+        libardrone.FFMPEG = ffmpeg
+        sim, drone = simulated(video, trace=True, bitrate=None)
+        try:
+            offset = time.time() - time.perf_counter()
+            frames = []
+            end = time.time() + (3. if QUICK else 8.)
+            for frame in drone.frames(timeout=2.):
+                frames.append((frame.seq, frame.timestamp))
+                if frame.timestamp > end: break
+        finally:
+            drone.halt()
+            sim.stop()
+    finally:
+        libardrone.FFMPEG = FFMPEG
+        os.remove(video)
+    sent = [t for t, _ in sim.frame_log]
+    latency = [timestamp - offset - sent[seq - 1] for seq, timestamp in frames if seq <= len(sent)]
+    r = distribution(latency)
+    for stage, stats in drone.tracer.stats().items():
+        r.update(('{}_{}'.format(stage, k), v) for k, v in stats.items() if k in ('p50', 'p99'))
+    return r
+
+def h264_clip(ffmpeg, seconds, size='640x360'):
+    """Returns an H.264 test clip (Annex B, no B-frames, an I-frame per second) encoded by *ffmpeg*."""
+    return subprocess.check_output((ffmpeg, '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size={}:rate=30'.format(size), '-t', str(seconds),
+      '-c:v', 'libx264', '-bf', '0', '-g', '30', '-f', 'h264', '-'))
+
+def pave_recording(filename, data, width=640, height=360, fps=30):
+    """Writes to *filename* a recording of the H.264 stream *data* as a drone would send it: PaVE frames, received in socket sized chunks at *fps*."""
+    recorder = recording.Recorder(filename)
+    for n, (frame_type, payload) in enumerate(simulator.h264_frames(data)):
+        recorder.video(simulator.pave_header(width, height, n, int(n * 1000 / fps), frame_type, len(payload)) + payload, n / fps)
+    recorder.close()
+
+def replay_decoded(decoder, seconds):
+    """
+Replays at real speed a recorded PaVE stream of a *seconds* long test clip, decoded by *decoder* (a factory of :class:`arnetwork.Decoder`). Returns the frame tracer, the number of frames and the CPU time of this process and of its children (ffmpeg), or None if ffmpeg, needed to encode the clip, is not found.
+    """
+    ffmpeg = ffmpeg_path()
+    if ffmpeg is None: return None
+    fd, filename = tempfile.mkstemp(suffix='.ardrone')
+    os.close(fd)
+    FFMPEG = libardrone.FFMPEG
+    try:
+        pave_recording(filename, h264_clip(ffmpeg, seconds))
+        libardrone.FFMPEG = ffmpeg
+        cpu, children = time.process_time(), resource.getrusage(resource.RUSAGE_CHILDREN)
+        drone = libardrone.ARDrone(replay=recording.Replay(filename), ports=dict(navdata_client=0), trace=True, decoder=decoder())
+        try: frames = sum(1 for _ in drone.frames(timeout=2.))
+        finally: drone.halt()
+        cpu, after = time.process_time() - cpu, resource.getrusage(resource.RUSAGE_CHILDREN)
+    finally:
+        libardrone.FFMPEG = FFMPEG
+        os.remove(filename)
+    return drone.tracer, frames, cpu, after.ru_utime + after.ru_stime - children.ru_utime - children.ru_stime
+
+def decoder_scenario(name, profile):
+    @benchmark('decoder_startup.' + name)
+    def bench_decoder_startup():
+        """Time to first image of the ffmpeg decoder (first payload written to first image read) and steady state decode latency, replaying a recorded PaVE stream at real speed."""
+        r = replay_decoded(lambda: arnetwork.FFmpegDecoder(profile), 3 if QUICK else 10)
+        if r is None: return dict(skipped='ffmpeg not found')
+        tracer, frames, _, _ = r
+        if tracer.first_frame is None: return dict(frames=0)
+        decode = tracer.stats()['decode']
+        return dict(first_frame_ms=tracer.first_frame * 1e3, decode_p50_ms=decode['p50'], decode_p99_ms=decode['p99'], frames=frames)
+
+decoder_scenario('probing', arnetwork.FFmpegProfile(low_latency=False))
+decoder_scenario('low_latency', arnetwork.FFmpegProfile())
+decoder_scenario('low_latency.2threads', arnetwork.FFmpegProfile(threads=2))
+
+DECODERS = {
+  'ffmpeg': arnetwork.FFmpegDecoder,
+  'pyav': arnetwork.PyAVDecoder,
+  }
+
+def backend_scenario(name):
+    @benchmark('decoder_backend.' + name)
+    def bench_decoder_backend():
+        """Latency (payload written to image published, and PaVE reception to image published) and CPU per frame (this process and ffmpeg) of a decoder backend, replaying a recorded PaVE stream at real speed."""
+        try: DECODERS[name]()
+        except ImportError as e: return dict(skipped=str(e))
+        r = replay_decoded(DECODERS[name], 3 if QUICK else 10)
+        if r is None: return dict(skipped='ffmpeg not found')
+        tracer, frames, cpu, children = r
+        if not frames: return dict(frames=0)
+        stats = tracer.stats()
+        window = tracer.window()
+        decoded = window[2] + window[3] # decode and publish stages
+        return dict(decode_p50_ms=float(numpy.percentile(decoded, 50) * 1e3), decode_p99_ms=float(numpy.percentile(decoded, 99) * 1e3),
+          total_p50_ms=stats['total']['p50'], total_p99_ms=stats['total']['p99'], first_frame_ms=tracer.first_frame * 1e3,
+          cpu_ms_per_frame=cpu / frames * 1e3, ffmpeg_cpu_ms_per_frame=children / frames * 1e3, frames=frames)
+
+for name in sorted(DECODERS): backend_scenario(name)
+
+#==================================================================================================
+# Fleet
+#==================================================================================================
+
+def fleet_ports(i, base=47000):
+    return dict(navdata=base + 4 * i, command=base + 4 * i + 1, video=base + 4 * i + 2, control=base + 4 * i + 3)
+
+def fleet_standin(n, rate, seconds):
+    """Plays *n* drones on localhost for *seconds*: sends navdata at *rate* Hz to the clients which sent a packet to the navdata port, accepts the control connections and acknowledges the configuration commands."""
+    selector = selectors.DefaultSelector()
+    nav = []
+    acks = [0] * n
+    for i in range(n):
+        ports = fleet_ports(i)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', ports['navdata']))
+        s.setblocking(0)
+        nav.append([s, None])
+        selector.register(s, selectors.EVENT_READ, nav[-1])
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', ports['command']))
+        selector.register(s, selectors.EVENT_READ, i)
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', ports['control']))
+        s.listen(1)
+        selector.register(s, selectors.EVENT_READ, 'listen')
+    seq_nr = 0
+    t = time.perf_counter()
+    end = t + seconds
+    while t < end:
+        t += 1. / rate
+        while True:
+            delay = t - time.perf_counter()
+            if delay <= 0: break
+            for key, _ in selector.select(delay):
+                if key.data == 'listen': selector.register(key.fileobj.accept()[0], selectors.EVENT_READ, None)
+                else:
+                    try: data, address = key.fileobj.recvfrom(4096)
+                    except OSError: selector.unregister(key.fileobj); continue
+                    if isinstance(key.data, int):
+                        for name, _, args in simulator.at_decode(data):
+                            if name == 'CONFIG': acks[key.data] = 1 << 6
+                            elif name == 'CTRL' and args[0] == 5: acks[key.data] = 0
+                    elif key.data is not None: key.data[1] = address
+        seq_nr += 1
+        for (s, address), ack in zip(nav, acks):
+            if address is not None: s.sendto(simulator.navdata_packet(seq_nr, ack), address)
+
+def bench_fleet(n, rate=200., seconds=5.):
+    """Returns the CPU time (in % of one core) used by a :class:`fleet.Fleet` of *n* drones without video, receiving navdata at *rate* Hz, and the number of navdata samples received per second and drone."""
+    standin = multiprocessing.Process(target=fleet_standin, args=(n, rate, seconds + n + 2.))
+    standin.start()
+    time.sleep(.5)
+    f = fleet.Fleet([dict(host='127.0.0.1', ports=fleet_ports(i)) for i in range(n)], video=False)
+    try:
+        f.hover()
+        time.sleep(1.)
+        before = [d.navdata_sample.seq for d in f]
+        t, cpu = time.perf_counter(), time.process_time()
+        time.sleep(seconds)
+        t, cpu = time.perf_counter() - t, time.process_time() - cpu
+        received = sum(d.navdata_sample.seq - b for d, b in zip(f, before))
+    finally:
+        f.halt()
+        standin.terminate()
+        standin.join()
+    return 100. * cpu / t, received / (n * t)
+
+def fleet_scenario(n):
+    def scenario():
+        cpu, rate = bench_fleet(n, seconds=2. if QUICK else 5.)
+        return dict(cpu_percent=cpu, cpu_percent_per_drone=cpu / n, navdata_per_s_per_drone=rate)
+    benchmark('e2e.fleet.{}'.format(n))(scenario)
+
+for n in 1, 4, 16: fleet_scenario(n)
+
+#==================================================================================================
+# Shared memory frame ring
+#==================================================================================================
+
+def ring_consumer(name, results):
+    """Reads the frames of ring *name* until none comes for a second, checking a sample of each image, and puts (frames, torn frames, CPU time) in queue *results*."""
+    ring = framering.FrameRing.attach(name)
+    frames = torn = 0
+    cpu = time.process_time()
+    for frame in ring.frames(timeout=1.):
+        frame.image[::16, ::16].sum()
+        if ring.valid(frame): frames += 1
+        else: torn += 1
+        del frame
+    results.put((frames, torn, time.process_time() - cpu))
+    ring.close()
+
+def bench_frame_ring(consumers, fps=30., seconds=5.):
+    output = arnetwork.OutputSpec(source=(1280, 720))
+    name = 'ardrone-bench-{}'.format(os.getpid())
+    ring = framering.FrameRing(name, output)
+    pool = arnetwork.FramePool(output, ring=ring)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=ring_consumer, args=(name, results)) for _ in range(consumers)]
+    try:
+        for p in procs: p.start()
+        time.sleep(.5) # consumers attached
+        publish = []
+        t0 = time.perf_counter()
+        n = int(seconds * fps)
+        for seq in range(1, n + 1):
+            image, buffer = pool.next()
+            image[::8] = seq % 256 # stands for the decoder writing the image
+            t = time.perf_counter()
+            ring.publish(image, seq, time.time())
+            publish.append(time.perf_counter() - t)
+            time.sleep(max(0., t0 + seq / fps - time.perf_counter()))
+        stats = [results.get(timeout=seconds + 5.) for _ in procs]
+        for p in procs: p.join()
+    finally:
+        del image, buffer, pool # views of the ring
+        ring.close()
+    received = [f / n for f, _, _ in stats]
+    return dict(delivered_min=min(received), delivered_mean=sum(received) / consumers, torn=sum(t for _, t, _ in stats),
+      consumer_cpu_ms_per_frame=max(c / max(f, 1) for f, _, c in stats) * 1e3, publish_p99_us=float(numpy.percentile(publish, 99) * 1e6), frames=n)
+
+def frame_ring_scenario(consumers):
+    @benchmark('frame_ring.{}'.format(consumers))
+    def bench():
+        """Fan-out of 720p rgb24 frames at 30 fps to consumer processes through a shared memory ring: fraction of the frames each consumer got, torn frames and cost of publishing."""
+        return bench_frame_ring(consumers, seconds=2. if QUICK else 5.)
+
+for n in 1, 4, 8: frame_ring_scenario(n)
+
+#==================================================================================================
+# Analysis pool
+#==================================================================================================
+
+def busy_analysis(image, navdata, seconds=.05):
+    """Stands for a vision model: about *seconds* of CPU per frame."""
+    end = time.process_time() + seconds
+    while time.process_time() < end: image[::32, ::32].sum()
+    return int(navdata['seq_nr'])
+
+def bench_analysis(workers, fps=30., seconds=5.):
+    output = arnetwork.OutputSpec()
+    ring = framering.FrameRing('ardrone-bench-{}'.format(os.getpid()), output)
+    pool = arnetwork.FramePool(output, ring=ring)
+    analysis = AnalysisPool(ring, workers)
+    analysis.add(busy_analysis)
+    depth = 0
+    try:
+        sample = arnetwork.NavdataSample(navdata.navdata_decode(simulator.navdata_packet(1))[0], 1, time.time())
+        t0 = time.perf_counter()
+        n = int(seconds * fps)
+        for seq in range(1, n + 1):
+            image, buffer = pool.next()
+            ring.publish(image, seq, time.time(), sample)
+            analysis.submit(image, seq, time.time(), sample)
+            depth = max(depth, analysis.in_flight)
+            time.sleep(max(0., t0 + seq / fps - time.perf_counter()))
+        elapsed = time.perf_counter() - t0
+        while analysis.in_flight: time.sleep(.01)
+        stats = analysis.stats()
+    finally:
+        analysis.close()
+        del image, buffer, pool # views of the ring
+        ring.close()
+    return dict(analyzed_fps=stats['completed'] / elapsed, drop_rate=stats['drop_rate'], max_queue_depth=depth, stale=stats['stale'],
+      latency_p50_ms=stats['latency']['p50'], latency_p99_ms=stats['latency']['p99'], compute_p50_ms=stats['compute']['p50'], cores=os.cpu_count())
+
+def analysis_scenario(workers):
+    @benchmark('analysis.{}'.format(workers))
+    def bench():
+        """Frames/sec analyzed by a pool of processes running a 50 ms analysis on 30 fps video, frames dropped while all workers are busy."""
+        return bench_analysis(workers, seconds=3. if QUICK else 10.)
+
+for n in 1, 2, 4: analysis_scenario(n)
+
+def main():
+    import argparse
+    global QUICK
+    parser = argparse.ArgumentParser(description='Runs the benchmarks of the package.')
+    parser.add_argument('names', nargs='*', help='prefixes of the benchmarks to run (all by default)')
+    parser.add_argument('--json', help='file where the results are written')
+    parser.add_argument('--quick', action='store_true', help='shorter runs')
+    parser.add_argument('--list', action='store_true', help='lists the benchmarks')
+    args = parser.parse_args()
+    if args.list:
+        for name, _ in BENCHMARKS: print(name)
+        return
+    QUICK = args.quick
+    report = run(args.names)
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(report, f, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ class DummyDrone (object):
 
     def __init__(self):
         self.image = numpy.zeros((360, 640, 3),'uint8')
-        self.navdata = [dict(battery=1.,altitude=0)]
+        self.navdata = {0: dict(battery=100,altitude=0)}
         self.network = DummyNetwork(self)
 
     def __getattr__(self,attr):
@@ -36,7 +36,7 @@ class DummyNetwork (object):
                 for t in R:
                     if not self.running: return
                     self.drone.set_image(t*u)
-                    self.drone.set_navdata([dict(battery=int(100*b),altitude=t)])
+                    self.drone.set_navdata({0: dict(battery=int(100*b),altitude=t)})
                     b *= .97
                     time.sleep(.3)
         self.drone = drone
@@ -0,0 +1,164 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Control of several drones from one process. The navdata, command and control sockets of all the drones of a :class:`Fleet` are multiplexed by a single :class:`Reactor` thread, instead of a set of threads per drone. Usage::
+
+  fleet = Fleet([dict(host='192.168.1.10'), dict(host='192.168.1.11')], video=False)
+  fleet.takeoff()
+  ...
+  fleet.land()
+  fleet.halt()
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+
+import libardrone
+
+#==================================================================================================
+class Reactor(object):
+    """
+An instance of this class runs a thread which waits for readable sockets with a :mod:`selectors` selector and runs the callbacks registered for them, as well as timed callbacks (on the :func:`time.perf_counter` clock). Its methods can be called from any thread. An exception raised by a callback is logged, and does not stop the reactor.
+    """
+#==================================================================================================
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.timers = [] # heap of (time, count, callback, args)
+        self.count = itertools.count() # tie breaker of the timers
+        self.lock = threading.Lock()
+        self.running = True
+        # a write on the waker wakes up the selector when a timer is added from another thread
+        self.waker, self.wakee = socket.socketpair()
+        self.waker.setblocking(0)
+        self.wakee.setblocking(0)
+        self.selector.register(self.wakee, selectors.EVENT_READ, self.drain)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def call_at(self, when, callback, *args):
+        with self.lock:
+            count = next(self.count)
+            heapq.heappush(self.timers, (when, count, callback, args))
+            first = self.timers[0][1] == count
+        if first and threading.current_thread() is not self.thread:
+            try: self.waker.send(b'\0')
+            except BlockingIOError: pass
+
+    def call_later(self, delay, callback, *args):
+        self.call_at(time.perf_counter() + delay, callback, *args)
+
+    def call_soon(self, callback, *args):
+        self.call_at(0., callback, *args)
+
+    def register(self, sock, callback):
+        """Calls *callback* (without argument) whenever *sock* is readable."""
+        if threading.current_thread() is self.thread:
+            self.selector.register(sock, selectors.EVENT_READ, callback)
+        else:
+            self.call_soon(self.register, sock, callback)
+
+    def unregister(self, sock):
+        if threading.current_thread() is self.thread:
+            try: self.selector.unregister(sock)
+            except (KeyError, ValueError): pass
+        else:
+            self.call_soon(self.unregister, sock)
+
+    def drain(self):
+        try:
+            while self.wakee.recv(4096): pass
+        except BlockingIOError: pass
+
+    def run(self):
+        logger.info('[reactor] Starting loop')
+        while self.running:
+            with self.lock:
+                timeout = max(self.timers[0][0] - time.perf_counter(), 0.) if self.timers else None
+            for key, _ in self.selector.select(timeout):
+                self.dispatch(key.data)
+            now = time.perf_counter()
+            while True:
+                with self.lock:
+                    if not self.timers or self.timers[0][0] > now: break
+                    _, _, callback, args = heapq.heappop(self.timers)
+                self.dispatch(callback, *args)
+        self.selector.close()
+        self.waker.close()
+        self.wakee.close()
+        logger.info('[reactor] Stopping loop')
+
+    def dispatch(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception('[reactor] Error in %r', callback)
+
+    def stop(self):
+        self.running = False
+        self.call_soon(lambda: None)
+        self.thread.join()
+
+#==================================================================================================
+class Fleet(object):
+    """
+An instance of this class controls the drones described by *specs*, a list of dicts of :class:`libardrone.ARDrone` keyword arguments (at least *host*, and *ports* if the drones are behind a port forwarding), completed by the keyword arguments *common*. The initial configurations of the drones are waited for together, for *config_timeout* seconds in all (default 5, see :func:`libardrone.wait_configs`). The drones share a :class:`Reactor`, and bind their navdata sockets to any free local port. The drones are accessible by index, and the broadcast methods (e.g. :meth:`land`) call the method of the same name of every drone.
+    """
+#==================================================================================================
+
+    def __init__(self, specs, **common):
+        timeout = common.pop('config_timeout', 5.) # for all the initial configurations at once
+        self.reactor = Reactor()
+        self.drones = []
+        try:
+            for spec in specs:
+                kwargs = dict(common, **spec)
+                kwargs['ports'] = dict(dict(navdata_client=0), **kwargs.get('ports', {}))
+                self.drones.append(libardrone.ARDrone(reactor=self.reactor, config_timeout=None, **kwargs))
+            if timeout is not None: libardrone.wait_configs([drone.initial_config for drone in self.drones], timeout)
+        except Exception:
+            self.halt()
+            raise
+
+    def __iter__(self): return iter(self.drones)
+    def __len__(self): return len(self.drones)
+    def __getitem__(self, i): return self.drones[i]
+
+    def broadcast(self, method, *args):
+        """Calls method *method* (a name) of every drone with arguments *args*, and returns the list of the results."""
+        return [getattr(drone, method)(*args) for drone in self.drones]
+
+    def takeoff(self): self.broadcast('takeoff')
+    def land(self): self.broadcast('land')
+    def hover(self): self.broadcast('hover')
+    def reset(self): self.broadcast('reset')
+
+    def halt(self):
+        self.broadcast('halt')
+        self.reactor.stop()
@@ -0,0 +1,182 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Fan-out of the decoded video frames to other processes, through a ring of frames in shared memory (:mod:`multiprocessing.shared_memory`). The drone decodes the images straight into the slots of the ring, and any number of consumer processes attach to it by name and read the frames in place, without copy. The producer never waits for the consumers: a slot is overwritten when its turn comes, and a consumer detects it by the version of the slot (a sequence lock), so it only sees complete frames. Usage::
+
+  drone = ARDrone(frame_ring='drone0')
+
+  # in another process
+  ring = FrameRing.attach('drone0')
+  for frame in ring.frames():
+      process(frame.image, frame.navdata) # the image is a view of the shared memory, valid while ring.valid(frame)
+  ring.close()
+"""
+
+import time
+import numpy
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+
+import arnetwork
+from navdata import HISTORY_DTYPE, history_record
+
+MAGIC = b'ARFR'
+LAYOUT = 1
+ALIGN = 64 # of the slot images, in bytes
+
+HEADER_DTYPE = numpy.dtype([('magic', 'S4'), ('layout', '<u4'), ('slots', '<u4'), ('width', '<u4'), ('height', '<u4'), ('pix_fmt', 'S12'),
+  ('stride', '<u8'), ('count', '<u8'), ('latest', '<u8')])
+# version is odd while the slot is written
+SLOT_DTYPE = numpy.dtype([('version', '<u8'), ('seq', '<u8'), ('timestamp', '<f8'), ('navdata', HISTORY_DTYPE)], align=True)
+
+# A frame read from the ring: image is a view of the shared memory, navdata a copy of its record; slot and version identify the frame for FrameRing.valid
+SharedFrame = namedtuple('SharedFrame', 'image seq timestamp navdata slot version')
+
+def aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def attach_memory(name):
+    """Opens the shared memory block *name*, without registering it to the resource tracker, which would destroy it when this process exits (before Python 3.13)."""
+    try: return shared_memory.SharedMemory(name, track=False)
+    except TypeError: pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None if rtype == 'shared_memory' else register(name, rtype)
+    try: return shared_memory.SharedMemory(name)
+    finally: resource_tracker.register = register
+
+#==================================================================================================
+class FrameRing(object):
+    """
+A ring of *slots* frames of format *output* (an :class:`arnetwork.OutputSpec`) in the shared memory block *name*, created by the producer with this constructor and opened by the consumers with :meth:`attach`. Each slot holds an image, its sequence number and time, and the navdata sample current when it was published (a record of :data:`navdata.HISTORY_DTYPE`, zero until the first sample).
+
+The producer writes a slot between :meth:`acquire` and :meth:`publish`, or copies an image into the next slot with :meth:`publish` alone. Readers use :meth:`latest` or :meth:`frames`, and :meth:`valid` to check that the slot of a frame has not been overwritten since it was read: with the default 8 slots at 30 fps, a frame stays valid for about 230 ms.
+
+The sequence lock relies on the stores of the producer becoming visible in order, as on x86; the counters are aligned 64-bit words, read and written atomically.
+    """
+#==================================================================================================
+
+    def __init__(self, name, output, slots=8, create=True, shm=None):
+        self.output = output
+        self.owner = create
+        stride = aligned(output.frame_size)
+        offset = aligned(HEADER_DTYPE.itemsize + slots * SLOT_DTYPE.itemsize)
+        if shm is None: shm = shared_memory.SharedMemory(name, create=True, size=offset + slots * stride)
+        self.shm = shm
+        self.name = shm.name
+        buffer = numpy.frombuffer(shm.buf, dtype='uint8')
+        self.header = buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE).reshape(())
+        self.slots = buffer[HEADER_DTYPE.itemsize:HEADER_DTYPE.itemsize + slots * SLOT_DTYPE.itemsize].view(SLOT_DTYPE)
+        self.versions = self.slots['version']
+        self.images, self.buffers = zip(*[output.allocate(buffer[offset + i * stride:offset + i * stride + output.frame_size]) for i in range(slots)])
+        self.writing = None # slot acquired by the producer
+        if create:
+            w, h = output.dimensions
+            self.header[...] = (MAGIC, LAYOUT, slots, w, h, output.pix_fmt.encode('ascii'), stride, 0, 0)
+
+    @classmethod
+    def attach(cls, name):
+        """Opens the existing ring *name*, as a consumer."""
+        shm = attach_memory(name)
+        header = numpy.frombuffer(shm.buf, dtype=HEADER_DTYPE, count=1)[0].copy()
+        if header['magic'] != MAGIC or header['layout'] != LAYOUT:
+            shm.close()
+            raise ValueError('{} is not a frame ring'.format(name))
+        output = arnetwork.OutputSpec(header['pix_fmt'].decode('ascii'), source=(int(header['width']), int(header['height'])))
+        slots = int(header['slots'])
+        return cls(name, output, slots, create=False, shm=shm)
+
+    def __len__(self):
+        return len(self.images)
+
+    # Producer
+
+    def acquire(self, i):
+        """Marks slot *i* as being written (its image is about to be overwritten). Does nothing once the ring is closed."""
+        versions = self.versions
+        if versions is None: return
+        if not versions[i] & 1: versions[i] += 1
+        self.writing = i
+
+    def publish(self, image, seq, timestamp, navdata=None):
+        """
+Publishes *image* with sequence number *seq*, time *timestamp* and the navdata sample *navdata* (a :class:`arnetwork.NavdataSample`, or None). If *image* is not the image of the slot acquired, it is copied into the next slot. Does nothing once the ring is closed (the caller must not close it during the call).
+        """
+        if self.header is None: return
+        i = self.writing
+        if i is None or image is not self.images[i]:
+            i = (int(self.header['latest']) + 1) % len(self.images) if int(self.header['count']) else 0
+            self.acquire(i)
+            if self.output.pix_fmt == 'yuv420p':
+                for src, dst in zip(image, self.images[i]): dst[...] = src
+            else: self.images[i][...] = image
+        slots = self.slots
+        slots['seq'][i] = seq
+        slots['timestamp'][i] = timestamp
+        if navdata is not None and navdata.timestamp is not None: slots['navdata'][i] = history_record(navdata.timestamp, navdata.navdata)
+        self.versions[i] += 1
+        self.writing = None
+        self.header['latest'] = i
+        self.header['count'] += 1
+
+    # Consumers
+
+    def latest(self):
+        """Returns the last frame published (a :class:`SharedFrame`), or None if there is none yet or the ring is closed."""
+        header, slots, versions, images = self.header, self.slots, self.versions, self.images
+        if header is None: return None
+        while True:
+            if not int(header['count']): return None
+            i = int(header['latest'])
+            version = int(versions[i])
+            if version & 1: # overwritten since it was published: there is a newer frame
+                time.sleep(0)
+                continue
+            seq, timestamp, navdata = int(slots['seq'][i]), float(slots['timestamp'][i]), slots['navdata'][i].copy()
+            if int(versions[i]) == version: return SharedFrame(images[i], seq, timestamp, navdata, i, version)
+
+    def valid(self, frame):
+        """Tells whether the slot of *frame* still holds it (its image has not been overwritten, not even partially)."""
+        return int(self.versions[frame.slot]) == frame.version
+
+    def frames(self, timeout=None, poll=.002):
+        """
+Generator of the frames as they are published, polled every *poll* seconds. Frames published while the consumer is busy are skipped. Stops when no frame arrives within *timeout* (if not None).
+        """
+        seq = None
+        t = time.perf_counter()
+        while True:
+            frame = self.latest()
+            if frame is not None and frame.seq != seq:
+                seq = frame.seq
+                t = time.perf_counter()
+                yield frame
+            elif timeout is not None and time.perf_counter() - t > timeout: return
+            else: time.sleep(poll)
+
+    def close(self):
+        """
+Detaches from the ring, and destroys it if it was created by this instance. The images of the frames read must have been released first (e.g. by a frame pool using the ring); else the memory stays mapped, and is unmapped with the ring once they are released.
+        """
+        if self.header is None: return
+        self.header = self.slots = self.versions = self.images = self.buffers = None
+        try: self.shm.close()
+        except BufferError: pass # views still in use
+        if self.owner: self.shm.unlink()
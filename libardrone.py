@@ -29,17 +29,32 @@ import socket
 import struct
 import threading
 import time
-import numpy
+import concurrent.futures
+from collections import namedtuple
 
 import arnetwork
+import arconfig
+from navdata import NavdataHistory, StateWatcher
+from recording import Recorder, Replay
+from framering import FrameRing
+from analysis import AnalysisPool
 
 # For video decoding
 FFMPEG = r'C:\Program Files (x86)\ffmpeg-20150304-git-7da7d26-win64-static\bin\ffmpeg.exe'
 
+ARDRONE_HOST = '192.168.1.1'
 ARDRONE_COMMAND_PORT = 5556
 ARDRONE_NAVDATA_PORT = 5554
 ARDRONE_VIDEO_PORT = 5555
 ARDRONE_CONTROL_PORT = 5559
+# ports of a drone, and local port bound for its navdata (0 for any: several drones in one process)
+ARDRONE_PORTS = dict(
+  command=ARDRONE_COMMAND_PORT,
+  navdata=ARDRONE_NAVDATA_PORT,
+  video=ARDRONE_VIDEO_PORT,
+  control=ARDRONE_CONTROL_PORT,
+  navdata_client=ARDRONE_NAVDATA_PORT,
+  )
 
 #==================================================================================================
 class ARDrone(object):
@@ -48,18 +63,34 @@ An instance of this class has methods to control the drone's motion. It launches
     """
 #==================================================================================================
 
-    def __init__(self,ssid=None,hd=False):
+    def __init__(self,ssid=None,hd=False,navdata_demo=True,history=None,history_file=None,rate=30.,
+                 host=ARDRONE_HOST,ports=None,reactor=None,video=True,trace=False,record=None,replay=None,output=None,decoder=None,frame_ring=None,config_timeout=5.):
 
         self.ssid = ssid
+        self.host = host
+        self.ports = dict(ARDRONE_PORTS, **(ports or {}))
+        self.reactor = reactor # shared I/O reactor (see fleet.Reactor), or None for dedicated threads
+        # raw recording of the navdata and video (see recording.Recorder), or replay of one instead of the drone
+        self.recorder = None if record is None else Recorder(record)
+        self.replay = Replay(replay) if isinstance(replay,str) else replay
+        if self.replay is not None: host = '127.0.0.1' # the commands must not reach a real drone
         self.seq_nr = 1
         self.timer_t = 0.2
-        self.com_watchdog_timer = threading.Timer(self.timer_t, self.commwdg)
         self.lock = threading.Lock()
+        self.channel = ATChannel((host,self.ports['command']),reactor=reactor)
+        self.last_command = time.perf_counter()
         self.speed = 0.2 # initial speed factor
         self.hd = hd
-        self.image_shape = (720, 1280, 3) if hd else (360, 640, 3)
+        # format of the decoded images (see arnetwork.OutputSpec)
+        self.output = (output or arnetwork.OutputSpec())._replace(source=(1280, 720) if hd else (640, 360))
+        self.decoder = decoder or arnetwork.FFmpegDecoder() # H.264 decoder backend (see arnetwork.Decoder)
+        self.image_shape = self.output.shape
         self.config_ids_string = ['943dac23','36355d78','21d958e4'] # do these have a speial meaning?
-        self.image = numpy.zeros(self.image_shape,dtype='uint8')
+        self.image = self.output.allocate()[0]
+        # shared memory ring the images are decoded into, for other processes (see framering.FrameRing)
+        self.frame_ring = FrameRing(frame_ring,self.output) if isinstance(frame_ring,str) else frame_ring
+        self.analysis = None # pool of the analysis functions (see analyze)
+        self.frame = arnetwork.Frame(self.image,0,None)
         self.navdata = dict()
         self.navdata[0] = dict(
           ctrl_state=0,
@@ -72,23 +103,32 @@ An instance of this class has methods to control the drone's motion. It launches
           vy=0.,
           vz=0.,
           num_frames=0)
-
-        self.network = arnetwork.network(self)
-
-        self.config({
-            'custom:session_id':self.config_ids_string[0],
-            'custom:profile_id':self.config_ids_string[1],
-            'custom:application_id':self.config_ids_string[2],
-            'video:bitrate_control_mode':1,
-            'video:video_channel':1,
-            'video:bitrate':500,
-            'video:max_bitrate':500,
-            'video:codec_fps':30,
-            'video:video_codec':'H264_720P_CODEC' if hd else 'H264_360P_CODEC',
-            'general:navdata_demo':True,
-            'control:altitude_max':20000,
-            })
-        time.sleep(1.)
+        self.navdata_sample = arnetwork.NavdataSample(self.navdata,0,None)
+        # publication of frames and navdata: version is odd while an update is in progress (see snapshot)
+        self.running = True
+        self.version = 0
+        self.publish_lock = threading.Lock()
+        self.frame_cond = threading.Condition(self.publish_lock)
+        self.navdata_cond = threading.Condition(self.publish_lock)
+        # optional record of the navdata samples (see navdata.NavdataHistory)
+        self.history = None if history is None else NavdataHistory(history,history_file)
+        # notification of the changes of the drone state flags
+        self.state_watcher = StateWatcher()
+        # optional latency tracing of the video frames (see arnetwork.FrameTracer)
+        self.tracer = arnetwork.FrameTracer() if trace else None
+
+        # configuration writes, acknowledged by the drone (see arconfig.ConfigManager)
+        self.configs = arconfig.ConfigManager(self,acknowledged=self.replay is None)
+        # configuration read from the drone, invalidated by the writes (see arconfig.ConfigCache)
+        self.config_cache = arconfig.ConfigCache(self)
+        self.configs.listeners.append(self.config_cache.invalidate)
+        self.scheduler = CommandScheduler(self,rate,reactor)
+
+        self.network = arnetwork.network(self,video)
+
+        # waited for config_timeout seconds, unless None (e.g. by a fleet, for all its drones at once: see wait_configs)
+        self.initial_config = self.config(default_config(self.config_ids_string,hd,navdata_demo))
+        if config_timeout is not None: wait_configs([self.initial_config],config_timeout)
 
     def takeoff(self):
         """Make the drone takeoff."""
@@ -97,43 +137,44 @@ An instance of this class has methods to control the drone's motion. It launches
 
     def land(self):
         """Make the drone land."""
+        self.setpoint(None)
         self.at(at_ref, False)
 
     def hover(self):
         """Make the drone hover."""
-        self.at(at_pcmd, False, 0, 0, 0, 0)
+        self.setpoint(False, 0, 0, 0, 0)
 
     def move_left(self):
         """Make the drone move left."""
-        self.at(at_pcmd, True, -self.speed, 0, 0, 0)
+        self.setpoint(True, -self.speed, 0, 0, 0)
 
     def move_right(self):
         """Make the drone move right."""
-        self.at(at_pcmd, True, self.speed, 0, 0, 0)
+        self.setpoint(True, self.speed, 0, 0, 0)
 
     def move_up(self):
         """Make the drone rise upwards."""
-        self.at(at_pcmd, True, 0, 0, self.speed, 0)
+        self.setpoint(True, 0, 0, self.speed, 0)
 
     def move_down(self):
         """Make the drone decent downwards."""
-        self.at(at_pcmd, True, 0, 0, -self.speed, 0)
+        self.setpoint(True, 0, 0, -self.speed, 0)
 
     def move_forward(self):
         """Make the drone move forward."""
-        self.at(at_pcmd, True, 0, -self.speed, 0, 0)
+        self.setpoint(True, 0, -self.speed, 0, 0)
 
     def move_backward(self):
         """Make the drone move backwards."""
-        self.at(at_pcmd, True, 0, self.speed, 0, 0)
+        self.setpoint(True, 0, self.speed, 0, 0)
 
     def turn_left(self):
         """Make the drone rotate left."""
-        self.at(at_pcmd, True, 0, 0, 0, -self.speed)
+        self.setpoint(True, 0, 0, 0, -self.speed)
 
     def turn_right(self):
         """Make the drone rotate right."""
-        self.at(at_pcmd, True, 0, 0, 0, self.speed)
+        self.setpoint(True, 0, 0, 0, self.speed)
 
     def reset(self):
         """Toggle the drone's emergency state."""
@@ -158,8 +199,9 @@ An instance of this class has methods to control the drone's motion. It launches
         """
         Set which video camera is used. If 'downward' is true,
         downward camera will be viewed - otherwise frontwards.
+        Returns a future done when the drone has switched.
         """
-        self.config({'video:video_channel':0 if downward else 1})
+        return self.config({'video:video_channel':0 if downward else 1})
 
     def event_boom(self):
         """Boom event"""
@@ -190,22 +232,33 @@ An instance of this class has methods to control the drone's motion. It launches
         """Wrapper for the low level at commands.
 
         This method takes care that the sequence number is increased after each
-        at command and the watchdog timer is started to make sure the drone
-        receives a command at least every second.
+        at command, and that the commands are sent in sequence order through the
+        command channel. The scheduler makes sure the drone receives a command
+        at least every :attr:`timer_t` seconds.
+        """
+        with self.lock:
+            self.channel.send(cmd(self.seq_nr, *args, **kwargs))
+            self.seq_nr += 1
+            self.last_command = time.perf_counter()
+
+    def setpoint(self, *pcmd):
+        """Set the motion command (the arguments of :func:`at_pcmd` after the
+        sequence number), sent repeatedly by the scheduler. Only the latest one
+        is sent. If None, the drone is idle and only watchdog commands are sent.
         """
-        self.lock.acquire()
-        self.com_watchdog_timer.cancel()
-        cmd(self.seq_nr, *args, **kwargs)
-        self.seq_nr += 1
-        self.com_watchdog_timer = threading.Timer(self.timer_t, self.commwdg)
-        self.com_watchdog_timer.start()
-        self.lock.release()
+        self.scheduler.setpoint = None if pcmd == (None,) else pcmd
 
     def config(self,cfg):
-        self.at(at_config_ids,self.config_ids_string)
-        for k,v in cfg.items():
-            v = config_options[k](v)
-            self.at(at_config,k,v)
+        """
+Writes the configuration keys of dict *cfg* (see :data:`config_options`), skipping those whose value is unchanged. Returns a :class:`concurrent.futures.Future` done when the drone has acknowledged them (see :class:`arconfig.ConfigManager`).
+        """
+        return self.configs.write(cfg)
+
+    def get_config(self,key=None,timeout=5.):
+        """
+Returns the value of configuration *key* (e.g. ``'video:bitrate'``) read from the drone, or the dict of the whole configuration if None. The configuration is fetched from the control port only when not cached, or when the key has been written since.
+        """
+        return self.config_cache.get(key,timeout)
 
     def commwdg(self):
         """Communication watchdog signal.
@@ -223,21 +276,221 @@ An instance of this class has methods to control the drone's motion. It launches
         application to close all sockets, pipes, processes and threads related
         with this object.
         """
-        self.lock.acquire()
-        self.com_watchdog_timer.cancel()
-        self.network.halt()
-        self.lock.release()
+        self.scheduler.stop()
+        self.configs.cancel()
+        with self.lock:
+            self.network.halt()
+            self.channel.close()
+            if self.recorder is not None: self.recorder.close()
+            if self.analysis is not None: self.analysis.close()
+        if self.frame_ring is not None:
+            with self.frame_cond: # not while set_image publishes, if the video thread did not stop in time
+                # the last image is kept as a copy, not as a view of the ring
+                image = self.image
+                image = type(image)(*(x.copy() for x in image)) if isinstance(image,tuple) else image.copy()
+                self.version += 1
+                self.frame = self.frame._replace(image=image)
+                self.image = image
+                self.version += 1
+                self.frame_ring.close()
+        with self.publish_lock:
+            self.running = False
+            self.frame_cond.notify_all()
+            self.navdata_cond.notify_all()
+
+    def set_image(self,image,seq=None,timestamp=None,trace=None):
+        with self.frame_cond:
+            if seq is None: seq = self.frame.seq+1
+            if timestamp is None: timestamp = time.time()
+            if trace is not None: self.tracer.published(trace)
+            if self.frame_ring is not None: self.frame_ring.publish(image,seq,timestamp,self.navdata_sample)
+            self.version += 1
+            self.frame = arnetwork.Frame(image,seq,timestamp,trace)
+            self.image = image
+            self.version += 1
+            self.frame_cond.notify_all()
+        if self.analysis is not None: self.analysis.submit(image,seq,timestamp,self.navdata_sample)
+
+    def analyze(self,function,callback=None,workers=None):
+        """
+Runs ``function(image,navdata)`` in a pool of *workers* processes (default: one per core, set by the first call) on the new frames, dropping the frames which come while all the workers are busy. The results are passed to *callback* (if not None) as :class:`analysis.AnalysisResult`, tagged with the frame sequence number and navdata sample. With a frame ring (see *frame_ring*), the workers read the images in place. Returns the :class:`analysis.AnalysisPool`, whose :meth:`stats` give the queue depth, drop rate and latencies.
+        """
+        with self.lock:
+            if self.analysis is None: self.analysis = AnalysisPool(self.frame_ring,workers)
+        self.analysis.add(function,callback)
+        return self.analysis
+
+    def set_drone_state(self,word):
+        """Called with the drone state word of every navdata packet, before it is decoded."""
+        self.state_watcher.update(word)
+        self.configs.on_state(word)
+        self.config_cache.on_tick()
+
+    def on_state_change(self,callback,bits=None,edge=None):
+        """
+Calls ``callback(name,value,state)`` when flags *bits* of the drone state change (names of :data:`navdata.DRONE_STATE_BITS`, e.g. ``'emergency_mask'``, or None for all), on their rise or fall only if *edge* is ``'rise'`` or ``'fall'``. The callback is called by the network thread as soon as a packet is received: it must be quick. Returns a token for :meth:`state_watcher.unsubscribe`.
+        """
+        return self.state_watcher.subscribe(callback,bits,edge)
+
+    def set_control(self,data):
+        """Called with the data received on the control port."""
+        self.config_cache.feed(data)
+
+    def set_navdata(self,navdata,timestamp=None):
+        if timestamp is None: timestamp = time.time()
+        with self.navdata_cond:
+            self.version += 1
+            self.navdata_sample = arnetwork.NavdataSample(navdata,self.navdata_sample.seq+1,timestamp)
+            self.navdata = navdata
+            self.version += 1
+            self.navdata_cond.notify_all()
+        if self.history is not None: self.history.append(timestamp,navdata)
+
+    def wait_frame(self,after_seq=None,timeout=None):
+        """
+Waits for a frame with sequence number greater than *after_seq* (default: the current one) and returns it as a :class:`arnetwork.Frame`, or None if *timeout* expires or the drone is halted first.
+        """
+        return self._wait(self.frame_cond,'frame',after_seq,timeout)
 
-    def set_image(self,image):
-        self.image = image
+    def wait_navdata(self,after_seq=None,timeout=None):
+        """Same as :meth:`wait_frame` for navdata samples (:class:`arnetwork.NavdataSample`)."""
+        return self._wait(self.navdata_cond,'navdata_sample',after_seq,timeout)
 
-    def set_navdata(self, navdata):
-        self.navdata = navdata
+    def frames(self,timeout=None):
+        """
+Generator of the successive frames, as they are published. Frames published while the consumer is busy are skipped. Stops when the drone is halted or no frame arrives within *timeout*.
+        """
+        return self._updates(self.wait_frame,timeout)
+
+    def navdata_updates(self,timeout=None):
+        """Same as :meth:`frames` for navdata samples."""
+        return self._updates(self.wait_navdata,timeout)
+
+    def snapshot(self):
+        """
+Returns the current frame and navdata sample as a :class:`Snapshot`, guaranteed to be coherent (neither was updated while the other was read). Never blocks the publishers: it retries if an update occurred meanwhile.
+        """
+        while True:
+            v = self.version
+            if not v&1:
+                s = Snapshot(self.frame,self.navdata_sample)
+                if self.version == v: return s
+            time.sleep(0)
+
+    def _wait(self,cond,attr,after_seq,timeout):
+        with cond:
+            if after_seq is None: after_seq = getattr(self,attr).seq
+            if not cond.wait_for(lambda: getattr(self,attr).seq>after_seq or not self.running,timeout): return None
+            return getattr(self,attr) if self.running else None
+
+    def _updates(self,wait,timeout):
+        seq = None
+        while True:
+            x = wait(seq,timeout)
+            if x is None: return
+            seq = x.seq
+            yield x
+
+# A coherent pair of a frame and a navdata sample (see ARDrone.snapshot)
+Snapshot = namedtuple('Snapshot','frame navdata')
+
+#==================================================================================================
+class CommandScheduler(object):
+    """
+An instance of this class runs a thread (or timers in *reactor*, see :class:`fleet.Reactor`) which, at a fixed *rate* (in Hz), sends to *drone* the latest motion command set in attribute :attr:`setpoint` (a tuple of arguments of :func:`at_pcmd`), or, if it is None, a watchdog command when no command has been sent for :attr:`ARDrone.timer_t` seconds. Each tick also drives the deadlines of the configuration writes (see :meth:`arconfig.ConfigManager.on_tick`). Ticks are on a fixed grid of :func:`time.perf_counter` deadlines, so delays do not accumulate; ticks late by a whole period or more are skipped. The lateness of each tick with respect to its deadline is accumulated in the statistics returned by :meth:`stats`.
+    """
+#==================================================================================================
+
+    def __init__(self, drone, rate, reactor=None):
+        self.drone = drone
+        self.reactor = reactor
+        self.period = 1. / rate
+        self.setpoint = None
+        self.running = True
+        self.ticks = 0
+        self.missed = 0
+        self.lateness_sum = 0.
+        self.lateness_sum2 = 0.
+        self.lateness_max = 0.
+        self.deadline = time.perf_counter() + self.period
+        if reactor is not None:
+            reactor.call_at(self.deadline, self.on_timer)
+            return
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            delay = self.deadline - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            self.tick()
+
+    def on_timer(self):
+        if not self.running: return
+        self.tick()
+        self.reactor.call_at(self.deadline, self.on_timer)
+
+    def tick(self):
+        """Runs the tick due at :attr:`deadline`, and sets the next deadline."""
+        period = self.period
+        lateness = time.perf_counter() - self.deadline
+        if lateness >= period:
+            n = int(lateness / period)
+            self.missed += n
+            self.deadline += n * period
+            lateness -= n * period
+        self.deadline += period
+        self.ticks += 1
+        self.lateness_sum += lateness
+        self.lateness_sum2 += lateness * lateness
+        if lateness > self.lateness_max: self.lateness_max = lateness
+        if not self.running: return
+        setpoint = self.setpoint
+        if setpoint is not None:
+            self.drone.at(at_pcmd, *setpoint)
+        elif time.perf_counter() - self.drone.last_command >= self.drone.timer_t:
+            self.drone.commwdg()
+        self.drone.configs.on_tick()
+
+    def stats(self):
+        """Returns a dict of the timing statistics of the ticks (lateness in seconds)."""
+        n = max(self.ticks, 1)
+        mean = self.lateness_sum / n
+        return dict(
+          rate=1. / self.period,
+          ticks=self.ticks,
+          missed=self.missed,
+          lateness_mean=mean,
+          lateness_std=max(self.lateness_sum2 / n - mean * mean, 0.) ** .5,
+          lateness_max=self.lateness_max,
+          )
+
+    def stop(self):
+        self.running = False
+        if self.reactor is None: self.thread.join()
 
 #==================================================================================================
 # Low level AT Commands
 #==================================================================================================
 
+# Precompiled templates of the commands (see at() for the generic encoding)
+_REF = b'AT*REF=%d,%d\r'
+_PCMD = b'AT*PCMD=%d,%d,%d,%d,%d,%d\r'
+_FTRIM = b'AT*FTRIM=%d\r'
+_ZAP = b'AT*ZAP=%d,%d\r'
+_CONFIG = b'AT*CONFIG=%d,"%s","%s"\r'
+_CONFIG_IDS = b'AT*CONFIG_IDS=%d,"%s","%s","%s"\r'
+_CTRL = b'AT*CTRL=%d,%d,0\r'
+_COMWDG = b'AT*COMWDG=%d\r'
+_AFLIGHT = b'AT*AFLIGHT=%d,%d\r'
+_LED = b'AT*LED=%d,%d,%d,%d\r'
+_ANIM = b'AT*ANIM=%d,%d,%d\r'
+_F4 = struct.Struct('<4f')
+_I4 = struct.Struct('<4i')
+_F1 = struct.Struct('<f')
+_I1 = struct.Struct('<i')
+
 def at_ref(seq, takeoff, emergency=False):
     """
     Basic behaviour of the drone: take-off/landing, emergency stop/reset)
@@ -252,7 +505,7 @@ def at_ref(seq, takeoff, emergency=False):
         p += 0b1000000000
     if emergency:
         p += 0b0100000000
-    at("REF", seq, [p])
+    return _REF % (seq, p)
 
 def at_pcmd(seq, progressive, lr, fb, vv, va):
     """
@@ -271,8 +524,7 @@ def at_pcmd(seq, progressive, lr, fb, vv, va):
 
     The above float values are a percentage of the maximum speed.
     """
-    p = 1 if progressive else 0
-    at("PCMD", seq, [p, float(lr), float(fb), float(vv), float(va)])
+    return _PCMD % ((seq, 1 if progressive else 0) + _I4.unpack(_F4.pack(lr, fb, vv, va))) # the 4 floats reinterpreted at once
 
 def at_ftrim(seq):
     """
@@ -281,7 +533,7 @@ def at_ftrim(seq):
     Parameters:
     seq -- sequence number
     """
-    at("FTRIM", seq, [])
+    return _FTRIM % seq
 
 def at_zap(seq, stream):
     """
@@ -292,26 +544,26 @@ def at_zap(seq, stream):
     stream -- Integer: video stream to broadcast
     """
     # FIXME: improve parameters to select the modes directly
-    at("ZAP", seq, [stream])
+    return _ZAP % (seq, stream)
 
 def at_config(seq, option, value):
     """Set configuration parameters of the drone."""
-    at("CONFIG", seq, [str(option), str(value)])
+    return _CONFIG % (seq, str(option).encode('ascii'), str(value).encode('ascii'))
 
 def at_config_ids(seq, value):
     """Set configuration parameters of the drone."""
-    at("CONFIG_IDS", seq, value)
+    return _CONFIG_IDS % ((seq,) + tuple(v.encode('ascii') for v in value))
 
 def at_ctrl(seq, num):
     """Ask the parrot to drop its configuration file"""
-    at("CTRL", seq, [num, 0])
+    return _CTRL % (seq, num)
 
 def at_comwdg(seq):
     """
     Reset communication watchdog.
     """
     # FIXME: no sequence number
-    at("COMWDG", seq, [])
+    return _COMWDG % seq
 
 def at_aflight(seq, flag):
     """
@@ -321,7 +573,7 @@ def at_aflight(seq, flag):
     seq -- sequence number
     flag -- Integer: 1: start flight, 0: stop flight
     """
-    at("AFLIGHT", seq, [flag])
+    return _AFLIGHT % (seq, flag)
 
 def at_pwm(seq, m1, m2, m3, m4):
     """
@@ -347,7 +599,7 @@ def at_led(seq, anim, f, d):
     f -- ?: frequence in HZ of the animation
     d -- Integer: total duration in seconds of the animation
     """
-    at("LED", seq, [anim, float(f), d]) 
+    return _LED % (seq, anim, f2i(f), d)
 
 def at_anim(seq, anim, d):
     """
@@ -358,10 +610,12 @@ def at_anim(seq, anim, d):
     anim -- Integer: animation to play
     d -- Integer: total duration in sections of the animation
     """
-    at("ANIM", seq, [anim, d])
+    return _ANIM % (seq, anim, d)
 
 def at(command, seq, params):
     """
+    Encode an AT command (generic, slower version of the at_* functions).
+
     Parameters:
     command -- the command
     seq -- the sequence number
@@ -376,8 +630,7 @@ def at(command, seq, params):
         elif type(p) == str:
             param_str += ',"' + p + '"'
     msg = "AT*%s=%i%s\r" % (command, seq, param_str)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.sendto(msg, ("192.168.1.1", ARDRONE_COMMAND_PORT))
+    return msg.encode('ascii')
 
 def f2i(f):
     """Interpret IEEE-754 floating-point value as signed integer.
@@ -385,7 +638,126 @@ def f2i(f):
     Arguments:
     f -- floating point value
     """
-    return struct.unpack('i', struct.pack('f', f))[0]
+    return _I1.unpack(_F1.pack(f))[0]
+
+#==================================================================================================
+class ATChannel(object):
+    """
+An instance of this class sends AT commands to the drone at *address* through a single connected UDP socket. The commands passed to :meth:`send` within *window* seconds of each other are coalesced, in order, into datagrams of at most :attr:`MAX_DATAGRAM` bytes, sent by a dedicated thread, or by a timer of *reactor* if given (see :class:`fleet.Reactor`).
+    """
+#==================================================================================================
+
+    MAX_DATAGRAM = 1024 # limit of the firmware
+    BUFFER_SIZE = 16384
+
+    def __init__(self, address=(ARDRONE_HOST, ARDRONE_COMMAND_PORT), window=0.002, reactor=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(address)
+        self.window = window
+        # commands are written in one of two reusable buffers while the other one is sent
+        self.buffers = [bytearray(self.BUFFER_SIZE), bytearray(self.BUFFER_SIZE)]
+        self.size = 0 # size of the pending commands in the current buffer
+        self.bounds = [] # end offsets of the pending commands in the current buffer
+        self.cond = threading.Condition()
+        self.running = True
+        self.commands_sent = 0
+        self.datagrams_sent = 0
+        self.error = None # errno of the last error while sending
+        self.reactor = reactor
+        if reactor is not None: return
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, msg):
+        """Queues the encoded command *msg*."""
+        with self.cond:
+            buffer = self.buffers[0]
+            n = self.size
+            m = self.size = n + len(msg)
+            if m > len(buffer): buffer.extend(bytes(max(m - len(buffer), len(buffer))))
+            buffer[n:m] = msg
+            self.bounds.append(m)
+            if len(self.bounds) == 1:
+                if self.reactor is None: self.cond.notify()
+                else: self.reactor.call_later(self.window, self.flush_pending)
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.bounds or not self.running)
+                if not self.bounds: break
+            if self.window: time.sleep(self.window)
+            self.flush_pending()
+        self.sock.close()
+
+    def flush_pending(self):
+        with self.cond:
+            buffer, bounds = self.buffers[0], self.bounds
+            self.buffers.reverse()
+            self.size = 0
+            self.bounds = []
+        if not bounds: return
+        try: self.flush(buffer, bounds)
+        except OSError as e:
+            if e.errno != self.error: logger.warning('[ATChannel] %s', e) # not repeated while the drone is unreachable
+            self.error = e.errno
+
+    def flush(self, buffer, bounds):
+        with memoryview(buffer) as view:
+            start = stop = 0
+            for end in bounds:
+                if end - start > self.MAX_DATAGRAM and stop > start:
+                    self.sock.send(view[start:stop])
+                    self.datagrams_sent += 1
+                    start = stop
+                stop = end
+            self.sock.send(view[start:stop])
+        self.datagrams_sent += 1
+        self.commands_sent += len(bounds)
+
+    def close(self):
+        """Sends the pending commands and closes the socket."""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.reactor is None:
+            self.thread.join()
+        elif threading.current_thread() is self.reactor.thread or not self.reactor.running:
+            self.last_flush()
+        else: # the reactor's timers may be flushing: the last flush must be done by the reactor too
+            done = threading.Event()
+            self.reactor.call_soon(self.last_flush, done)
+            if not done.wait(1.): logger.warning('[ATChannel] reactor not responding: pending commands not sent')
+
+    def last_flush(self, done=None):
+        self.flush_pending()
+        self.sock.close()
+        if done is not None: done.set()
+
+def wait_configs(futures,timeout):
+    """Waits up to *timeout* seconds in all for the configuration writes *futures* (e.g. the initial configurations of several drones), logging those not acknowledged."""
+    concurrent.futures.wait(futures,timeout)
+    for future in futures:
+        if future.cancelled(): continue
+        if not future.done(): logger.warning('[config] Initial configuration: no acknowledgement')
+        elif future.exception() is not None: logger.warning('[config] Initial configuration: %s',future.exception())
+
+def default_config(config_ids,hd,navdata_demo):
+    """Configuration sent to the drone on connection."""
+    return {
+        'custom:session_id':config_ids[0],
+        'custom:profile_id':config_ids[1],
+        'custom:application_id':config_ids[2],
+        'video:bitrate_control_mode':1,
+        'video:video_channel':1,
+        'video:bitrate':500,
+        'video:max_bitrate':500,
+        'video:codec_fps':30,
+        'video:video_codec':'H264_720P_CODEC' if hd else 'H264_360P_CODEC',
+        'general:navdata_demo':navdata_demo,
+        'control:altitude_max':20000,
+        }
 
 #==================================================================================================
 # Utilities
@@ -432,8 +804,8 @@ config_options = {
     'video:max_bitrate': check_int(low=1),
     'video:video_channel': check_int(low=0,high=1),
     'video:codec_fps': check_int(low=1),
-    'video:video_codec': check_vcodec,
+    'video:video_codec': check_vcodec(),
     'general:navdata_demo': check_bool,
-    'control:altitutde_max': check_int(low=10,high=100000),
+    'control:altitude_max': check_int(low=10,high=100000),
     }
 
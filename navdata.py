@@ -0,0 +1,542 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Decoding of the navdata packets sent by the drone on the navdata port. A packet is a header followed by a sequence of options, each starting with its tag and size (navdata_option_t in navdata_common.h of the SDK). The layout of each known option is precompiled in :data:`options`, keyed by tag.
+"""
+
+import struct
+import threading
+import numpy
+
+HEADER = struct.Struct('<IIII') # header, drone_state, seq_nr, vision_flag
+OPTION = struct.Struct('<HH') # tag, size
+NAVDATA_HEADER = 0x55667788
+NAVDATA_MAX_SIZE = 4096
+NAVDATA_HEADER_SIZE = HEADER.size
+_STATE_WORD = struct.Struct('<4xI')
+
+def drone_state_word(packet):
+    """Returns the drone state word of a navdata packet, without decoding it."""
+    return _STATE_WORD.unpack_from(packet)[0]
+
+#==================================================================================================
+class option(object):
+    """
+An instance of this class describes the layout of the navdata option with tag *tag*. Each field is given as a pair (name, format), where format is a :mod:`struct` format, possibly with a repeat count, in which case the field value is a tuple. If *post* is not None, it is applied to the dict of decoded fields.
+    """
+#==================================================================================================
+
+    def __init__(self, tag, name, fields, post=None):
+        self.tag = tag
+        self.name = name
+        self.fields = fields
+        self.struct = struct.Struct('<' + ''.join(fmt for _, fmt in fields))
+        self.names = tuple(n for n, _ in fields)
+        self.layout = []
+        i = 0
+        for n, fmt in fields:
+            k = int(fmt[:-1]) if len(fmt) > 1 else 1
+            self.layout.append((n, i if k == 1 else slice(i, i + k)))
+            i += k
+        self.grouped = i > len(fields)
+        self.dtype = numpy.dtype([(n, '<' + fmt[-1], (int(fmt[:-1]),)) if len(fmt) > 1 else (n, '<' + fmt) for n, fmt in fields])
+        assert self.dtype.itemsize == self.struct.size
+        self.post = post
+
+    def decode(self, packet, offset):
+        values = self.struct.unpack_from(packet, offset)
+        if self.grouped: d = dict((n, values[s]) for n, s in self.layout)
+        else: d = dict(zip(self.names, values))
+        if self.post is not None:
+            self.post(d)
+        return d
+
+def _demo_post(d):
+    # convert the millidegrees into degrees and round to int, as they
+    # are not so precise anyways
+    for i in 'theta', 'phi', 'psi':
+        d[i] = int(d[i] / 1000)
+
+options = dict((o.tag, o) for o in (
+  option(0, 'demo', (
+    ('ctrl_state', 'I'), ('battery', 'I'), ('theta', 'f'), ('phi', 'f'), ('psi', 'f'),
+    ('altitude', 'i'), ('vx', 'f'), ('vy', 'f'), ('vz', 'f'), ('num_frames', 'I'),
+    ), post=_demo_post),
+  option(1, 'time', (('time', 'I'),)),
+  option(2, 'raw_measures', (
+    ('raw_accs', '3H'), ('raw_gyros', '3h'), ('raw_gyros_110', '2h'), ('vbat_raw', 'I'),
+    ('us_debut_echo', 'H'), ('us_fin_echo', 'H'), ('us_association_echo', 'H'), ('us_distance_echo', 'H'),
+    ('us_courbe_temps', 'H'), ('us_courbe_valeur', 'H'), ('us_courbe_ref', 'H'), ('flag_echo_ini', 'H'),
+    ('nb_echo', 'H'), ('sum_echo', 'I'), ('alt_temp_raw', 'i'), ('gradient', 'h'),
+    )),
+  option(3, 'phys_measures', (
+    ('accs_temp', 'f'), ('gyro_temp', 'H'), ('phys_accs', '3f'), ('phys_gyros', '3f'),
+    ('alim3V3', 'I'), ('vrefEpson', 'I'), ('vrefIDG', 'I'),
+    )),
+  option(4, 'gyros_offsets', (('offset_g', '3f'),)),
+  option(5, 'euler_angles', (('theta_a', 'f'), ('phi_a', 'f'))),
+  option(6, 'references', (
+    ('ref_theta', 'i'), ('ref_phi', 'i'), ('ref_theta_I', 'i'), ('ref_phi_I', 'i'),
+    ('ref_pitch', 'i'), ('ref_roll', 'i'), ('ref_yaw', 'i'), ('ref_psi', 'i'),
+    ('vx_ref', 'f'), ('vy_ref', 'f'), ('theta_mod', 'f'), ('phi_mod', 'f'),
+    ('k_v_x', 'f'), ('k_v_y', 'f'), ('k_mode', 'I'),
+    ('ui_time', 'f'), ('ui_theta', 'f'), ('ui_phi', 'f'), ('ui_psi', 'f'), ('ui_psi_accuracy', 'f'), ('ui_seq', 'i'),
+    )),
+  option(7, 'trims', (('angular_rates_trim_r', 'f'), ('euler_angles_trim_theta', 'f'), ('euler_angles_trim_phi', 'f'))),
+  option(8, 'rc_references', (
+    ('rc_ref_pitch', 'i'), ('rc_ref_roll', 'i'), ('rc_ref_yaw', 'i'), ('rc_ref_gaz', 'i'), ('rc_ref_ag', 'i'),
+    )),
+  option(9, 'pwm', (
+    ('motor', '4B'), ('sat_motor', '4B'),
+    ('gaz_feed_forward', 'f'), ('gaz_altitude', 'f'), ('altitude_integral', 'f'), ('vz_ref', 'f'),
+    ('u_pitch', 'i'), ('u_roll', 'i'), ('u_yaw', 'i'), ('yaw_u_I', 'f'),
+    ('u_pitch_planif', 'i'), ('u_roll_planif', 'i'), ('u_yaw_planif', 'i'), ('u_gaz_planif', 'f'),
+    ('current_motor', '4H'), ('altitude_prop', 'f'), ('altitude_der', 'f'),
+    )),
+  option(10, 'altitude', (
+    ('altitude_vision', 'i'), ('altitude_vz', 'f'), ('altitude_ref', 'i'), ('altitude_raw', 'i'),
+    ('obs_accZ', 'f'), ('obs_alt', 'f'), ('obs_x', '3f'), ('obs_state', 'I'), ('est_vb', '2f'), ('est_state', 'I'),
+    )),
+  option(11, 'vision_raw', (('vision_tx_raw', 'f'), ('vision_ty_raw', 'f'), ('vision_tz_raw', 'f'))),
+  option(12, 'vision_of', (('of_dx', '5f'), ('of_dy', '5f'))),
+  option(13, 'vision', (
+    ('vision_state', 'I'), ('vision_misc', 'i'),
+    ('vision_phi_trim', 'f'), ('vision_phi_ref_prop', 'f'), ('vision_theta_trim', 'f'), ('vision_theta_ref_prop', 'f'),
+    ('new_raw_picture', 'i'), ('theta_capture', 'f'), ('phi_capture', 'f'), ('psi_capture', 'f'),
+    ('altitude_capture', 'i'), ('time_capture', 'I'), ('body_v', '3f'),
+    ('delta_phi', 'f'), ('delta_theta', 'f'), ('delta_psi', 'f'),
+    ('gold_defined', 'I'), ('gold_reset', 'I'), ('gold_x', 'f'), ('gold_y', 'f'),
+    )),
+  option(14, 'vision_perf', (
+    ('time_szo', 'f'), ('time_corners', 'f'), ('time_compute', 'f'), ('time_tracking', 'f'),
+    ('time_trans', 'f'), ('time_update', 'f'), ('time_custom', '20f'),
+    )),
+  option(15, 'trackers_send', (('locked', '30i'), ('point', '60i'))),
+  option(16, 'vision_detect', (
+    ('nb_detected', 'I'), ('type', '4I'), ('xc', '4I'), ('yc', '4I'), ('width', '4I'), ('height', '4I'),
+    ('dist', '4I'), ('orientation_angle', '4f'), ('rotation', '36f'), ('translation', '12f'), ('camera_source', '4I'),
+    )),
+  option(17, 'watchdog', (('watchdog', 'i'),)),
+  option(18, 'adc_data_frame', (('version', 'I'), ('data_frame', '32B'))),
+  option(19, 'video_stream', (
+    ('quant', 'B'), ('frame_size', 'I'), ('frame_number', 'I'), ('atcmd_ref_seq', 'I'),
+    ('atcmd_mean_ref_gap', 'I'), ('atcmd_var_ref_gap', 'f'), ('atcmd_ref_quality', 'I'),
+    ('out_bitrate', 'I'), ('desired_bitrate', 'I'),
+    ('data1', 'i'), ('data2', 'i'), ('data3', 'i'), ('data4', 'i'), ('data5', 'i'),
+    ('tcp_queue_level', 'I'), ('fifo_queue_level', 'I'),
+    )),
+  option(20, 'games', (('double_tap_counter', 'I'), ('finish_line_counter', 'I'))),
+  option(21, 'pressure_raw', (('up', 'i'), ('ut', 'h'), ('temperature_meas', 'i'), ('pression_meas', 'i'))),
+  option(22, 'magneto', (
+    ('mx', 'h'), ('my', 'h'), ('mz', 'h'),
+    ('magneto_raw', '3f'), ('magneto_rectified', '3f'), ('magneto_offset', '3f'),
+    ('heading_unwrapped', 'f'), ('heading_gyro_unwrapped', 'f'), ('heading_fusion_unwrapped', 'f'),
+    ('magneto_calibration_ok', 'B'), ('magneto_state', 'I'), ('magneto_radius', 'f'),
+    ('error_mean', 'f'), ('error_var', 'f'),
+    )),
+  option(23, 'wind_speed', (
+    ('wind_speed', 'f'), ('wind_angle', 'f'), ('wind_compensation_theta', 'f'), ('wind_compensation_phi', 'f'),
+    ('state_x1', 'f'), ('state_x2', 'f'), ('state_x3', 'f'), ('state_x4', 'f'), ('state_x5', 'f'), ('state_x6', 'f'),
+    ('magneto_debug1', 'f'), ('magneto_debug2', 'f'), ('magneto_debug3', 'f'),
+    )),
+  option(24, 'kalman_pressure', (
+    ('offset_pressure', 'f'), ('est_z', 'f'), ('est_zdot', 'f'), ('est_bias_PWM', 'f'), ('est_biais_pression', 'f'),
+    ('offset_US', 'f'), ('prediction_US', 'f'), ('cov_alt', 'f'), ('cov_PWM', 'f'), ('cov_vitesse', 'f'),
+    ('bool_effet_sol', 'i'), ('somme_inno', 'f'), ('flag_rejet_US', 'i'), ('u_multisinus', 'f'),
+    ('gaz_altitude', 'f'), ('flag_multisinus', 'i'), ('flag_multisinus_debut', 'i'),
+    )),
+  option(25, 'hdvideo_stream', (
+    ('hdvideo_state', 'I'), ('storage_fifo_nb_packets', 'I'), ('storage_fifo_size', 'I'),
+    ('usbkey_size', 'I'), ('usbkey_freespace', 'I'), ('frame_number', 'I'), ('usbkey_remaining_time', 'I'),
+    )),
+  option(26, 'wifi', (('link_quality', 'I'),)),
+  option(27, 'zimmu_3000', (('vzimmuLSB', 'i'), ('vzfind', 'f'))),
+  option(0xffff, 'checksum', (('cks', 'I'),)),
+  ))
+
+#==================================================================================================
+# Drone state
+#==================================================================================================
+
+# (name, bit) of the flags of the drone_state word of the header (def_ardrone_state_mask_t in config.h)
+DRONE_STATE_BITS = (
+  ('fly_mask', 0), # FLY MASK : (0) ardrone is landed, (1) ardrone is flying
+  ('video_mask', 1), # VIDEO MASK : (0) video disable, (1) video enable
+  ('vision_mask', 2), # VISION MASK : (0) vision disable, (1) vision enable
+  ('control_mask', 3), # CONTROL ALGO (0) euler angles control, (1) angular speed control
+  ('altitude_mask', 4), # ALTITUDE CONTROL ALGO : (0) altitude control inactive (1) altitude control active
+  ('user_feedback_start', 5), # USER feedback : Start button state
+  ('command_mask', 6), # Control command ACK : (0) None, (1) one received
+  ('fw_file_mask', 7), # Firmware file is good (1)
+  ('fw_ver_mask', 8), # Firmware update is newer (1)
+  ('fw_upd_mask', 9), # Firmware update is ongoing (1)
+  ('navdata_demo_mask', 10), # Navdata demo : (0) All navdata, (1) only navdata demo
+  ('navdata_bootstrap', 11), # Navdata bootstrap : (0) options sent in all or demo mode, (1) no navdata options sent
+  ('motors_mask', 12), # Motor status : (0) Ok, (1) Motors problem
+  ('com_lost_mask', 13), # Communication lost : (1) com problem, (0) Com is ok
+  ('vbat_low', 15), # VBat low : (1) too low, (0) Ok
+  ('user_el', 16), # User Emergency Landing : (1) User EL is ON, (0) User EL is OFF
+  ('timer_elapsed', 17), # Timer elapsed : (1) elapsed, (0) not elapsed
+  ('angles_out_of_range', 19), # Angles : (0) Ok, (1) out of range
+  ('ultrasound_mask', 21), # Ultrasonic sensor : (0) Ok, (1) deaf
+  ('cutout_mask', 22), # Cutout system detection : (0) Not detected, (1) detected
+  ('pic_version_mask', 23), # PIC Version number OK : (0) a bad version number, (1) version number is OK
+  ('atcodec_thread_on', 24), # ATCodec thread ON : (0) thread OFF (1) thread ON
+  ('navdata_thread_on', 25), # Navdata thread ON : (0) thread OFF (1) thread ON
+  ('video_thread_on', 26), # Video thread ON : (0) thread OFF (1) thread ON
+  ('acq_thread_on', 27), # Acquisition thread ON : (0) thread OFF (1) thread ON
+  ('ctrl_watchdog_mask', 28), # CTRL watchdog : (1) delay in control execution (> 5ms), (0) control is well scheduled
+  ('adc_watchdog_mask', 29), # ADC Watchdog : (1) delay in uart2 dsr (> 5ms), (0) uart2 is good
+  ('com_watchdog_mask', 30), # Communication Watchdog : (1) com problem, (0) Com is ok
+  ('emergency_mask', 31), # Emergency landing : (0) no emergency, (1) emergency
+  )
+
+STATE_BITS = dict(DRONE_STATE_BITS)
+STATE_NAMES = dict((b, n) for n, b in DRONE_STATE_BITS)
+
+class DroneState(int):
+    """
+A drone state word: an :class:`int`, whose flags (see :data:`DRONE_STATE_BITS`) are read by name as items or attributes (e.g. ``state['fly_mask']``, ``state.fly_mask``), without building a dict. Method :meth:`as_dict` returns the dict of all the flags.
+    """
+    __slots__ = ()
+
+    @property
+    def word(self):
+        return int(self)
+
+    def __getitem__(self, name):
+        return self >> STATE_BITS[name] & 1
+
+    def __getattr__(self, name):
+        try: return self >> STATE_BITS[name] & 1
+        except KeyError: raise AttributeError(name)
+
+    def __contains__(self, name):
+        return name in STATE_BITS
+
+    def __iter__(self):
+        return iter(STATE_BITS)
+
+    def keys(self):
+        return STATE_BITS.keys()
+
+    def items(self):
+        return [(n, self >> b & 1) for n, b in DRONE_STATE_BITS]
+
+    def get(self, name, default=None):
+        return self[name] if name in STATE_BITS else default
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return 'DroneState(0x{:08x})'.format(self)
+
+def state_mask(bits):
+    """Returns the mask of the flags *bits* (names, or None for all of them)."""
+    if bits is None: return 0xffffffff
+    if isinstance(bits, str): bits = (bits,)
+    mask = 0
+    for n in bits: mask |= 1 << STATE_BITS[n]
+    return mask
+
+#==================================================================================================
+class StateWatcher(object):
+    """
+An instance of this class calls subscribed callbacks when flags of the drone state change. Method :meth:`update` is passed the state word of each packet; the flags which changed are found by a XOR with the previous word, so that nothing is done when the state is unchanged (most packets). A callback is called as ``callback(name, value, state)`` for each changed flag it subscribed to, in the order of the bits.
+    """
+#==================================================================================================
+
+    def __init__(self):
+        self.word = None # last state word
+        self.subscriptions = dict() # token: (mask, edge, callback)
+        self.count = 0
+        self.mask = 0 # union of the masks of the subscriptions
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback, bits=None, edge=None):
+        """
+Subscribes *callback* to the changes of the flags *bits* (a name, a list of names, or None for all). If *edge* is ``'rise'`` (resp. ``'fall'``), only the changes to 1 (resp. 0) are reported. Returns a token for :meth:`unsubscribe`.
+        """
+        assert edge in (None, 'rise', 'fall')
+        with self.lock:
+            self.count += 1
+            self.subscriptions[self.count] = (state_mask(bits), edge, callback)
+            self.mask |= state_mask(bits)
+            return self.count
+
+    def unsubscribe(self, token):
+        with self.lock:
+            del self.subscriptions[token]
+            self.mask = 0
+            for mask, _, _ in self.subscriptions.values(): self.mask |= mask
+
+    def update(self, word):
+        previous, self.word = self.word, word
+        if previous is None: return
+        changed = (word ^ previous) & self.mask
+        if not changed: return
+        state = DroneState(word)
+        with self.lock: subscriptions = list(self.subscriptions.values())
+        while changed:
+            low = changed & -changed
+            changed ^= low
+            value = 1 if word & low else 0
+            name = STATE_NAMES.get(low.bit_length() - 1)
+            if name is None: continue
+            for mask, edge, callback in subscriptions:
+                if not mask & low: continue
+                if edge == 'rise' and not value or edge == 'fall' and value: continue
+                callback(name, value, state)
+
+#==================================================================================================
+# Decoding
+#==================================================================================================
+
+_FIELDS = ('header', 'drone_state', 'seq_nr', 'vision_flag')
+_layouts = {} # shared option offsets, by layout
+
+def option_offsets(packet):
+    """
+Returns a dict of the offsets of the bodies of the known options of *packet*, by tag (truncated options excluded). The dicts are shared by the packets with the same layout, and must not be modified.
+    """
+    layout = []
+    offset = HEADER.size
+    end = len(packet) - OPTION.size
+    while offset <= end:
+        tag, size = OPTION.unpack_from(packet, offset)
+        if size < OPTION.size: break # corrupted
+        o = options.get(tag)
+        if o is not None:
+            if offset + OPTION.size + o.struct.size > len(packet): break # truncated
+            layout.append((tag, offset + OPTION.size))
+        offset += size
+    layout = tuple(layout)
+    offsets = _layouts.get(layout)
+    if offsets is None:
+        if len(_layouts) > 1024: _layouts.clear()
+        offsets = _layouts[layout] = dict(layout)
+    return offsets
+
+#==================================================================================================
+class Navdata(object):
+    """
+A navdata packet, read as a dict with keys ``header``, ``drone_state`` (a :class:`DroneState`), ``seq_nr``, ``vision_flag`` and, for each known option found in the packet, its tag. The raw packet (the :class:`bytes` received, kept in attribute :attr:`packet`) is only indexed on creation: an option is decoded on first access, and cached.
+    """
+#==================================================================================================
+    __slots__ = ('packet', 'header', 'drone_state', 'seq_nr', 'vision_flag', 'offsets', 'decoded')
+
+    def __init__(self, packet):
+        self.packet = packet
+        self.header, state, self.seq_nr, self.vision_flag = HEADER.unpack_from(packet, 0)
+        self.drone_state = DroneState(state)
+        self.offsets = option_offsets(packet)
+        self.decoded = None
+
+    def __getitem__(self, key):
+        if key.__class__ is int:
+            decoded = self.decoded
+            if decoded is None: decoded = self.decoded = {}
+            elif key in decoded: return decoded[key]
+            d = decoded[key] = options[key].decode(self.packet, self.offsets[key])
+            return d
+        if key in _FIELDS: return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.offsets or key in _FIELDS
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(_FIELDS) + len(self.offsets)
+
+    def keys(self):
+        return _FIELDS + tuple(self.offsets)
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def as_dict(self):
+        """Returns the packet fully decoded, as a dict."""
+        return dict(self.items())
+
+    def __repr__(self):
+        return 'Navdata(seq_nr={}, options={})'.format(self.seq_nr, sorted(self.offsets))
+
+def navdata_decode(packet):
+    """
+Decode a navdata packet (:class:`bytes`). Returns a pair of the packet, as a :class:`Navdata` record, and a flag telling whether the packet contains the demo option. Options with an unknown tag are skipped.
+    """
+    data = Navdata(packet)
+    return data, 0 in data.offsets
+
+def navdata_decode_dict(packet):
+    """Same as :func:`navdata_decode`, but all the options are decoded at once into a dict."""
+    header, state, seq_nr, vision_flag = HEADER.unpack_from(packet, 0)
+    data = dict(header=header, drone_state=DroneState(state), seq_nr=seq_nr, vision_flag=vision_flag)
+    for tag, offset in option_offsets(packet).items():
+        data[tag] = options[tag].decode(packet, offset)
+    return data, 0 in data
+
+#==================================================================================================
+# Batch decoding
+#==================================================================================================
+
+STATE_DTYPE = numpy.dtype([(n, '<u4') for n in ('header', 'drone_state', 'seq_nr', 'vision_flag')] + [(n, 'u1') for n, _ in DRONE_STATE_BITS])
+UNKNOWN_DTYPE = numpy.dtype([('offset', '<i8'), ('size', '<u2')])
+
+def navdata_decode_batch(packets, offsets=None):
+    """
+Decodes many navdata packets at once, using vectorized operations across packets. *packets* is either a list of packets, or, if *offsets* is not None, a single buffer holding the concatenated packets, *offsets* being the sequence of their start offsets in the buffer (each packet ends where the next one starts). Returns a dict with the following items:
+
+* ``state``: a structured array with one row per packet, holding the header fields and the flags of its ``drone_state`` word (see :data:`DRONE_STATE_BITS`);
+* for each known option found in at least one packet, its name (e.g. ``demo``): a masked structured array with one row per packet and one column per field of the option (see :data:`options`), masked for the packets which do not contain that option (or where it is truncated);
+* for each unknown tag found in at least one packet, the tag itself: a masked structured array with fields ``offset`` (of the option body in the buffer) and ``size``, masked likewise.
+
+Values are in the units of the drone, without the post-processing of :func:`navdata_decode` (e.g. the demo angles are in millidegrees).
+    """
+    if offsets is None:
+        starts = numpy.zeros(len(packets), dtype=numpy.int64)
+        numpy.cumsum([len(p) for p in packets[:-1]], out=starts[1:])
+        packets = b''.join(packets)
+    else:
+        starts = numpy.asarray(offsets, dtype=numpy.int64)
+    raw = numpy.frombuffer(packets, dtype=numpy.uint8)
+    n = len(starts)
+    if not n: return dict(state=numpy.empty(0, dtype=STATE_DTYPE))
+    ends = numpy.empty(n, dtype=numpy.int64)
+    ends[:-1] = starts[1:]
+    ends[-1] = len(raw)
+    if (ends - starts).min() < HEADER.size:
+        raise ValueError('Truncated navdata packet')
+    def gather(pos, size): # copies raw[p:p+size] for each p in pos into a 2d array
+        return numpy.lib.stride_tricks.sliding_window_view(raw, size)[pos]
+    header = gather(starts, HEADER.size).view('<u4')
+    state = numpy.empty(n, dtype=STATE_DTYPE)
+    for i, k in enumerate(('header', 'drone_state', 'seq_nr', 'vision_flag')):
+        state[k] = header[:, i]
+    word = header[:, 1]
+    for k, b in DRONE_STATE_BITS:
+        state[k] = (word >> b) & 1
+    result = dict(state=state)
+    # walk the option chains of all the packets in parallel
+    found = {} # tag -> (offset of option body or -1, size) per packet
+    pos = starts + HEADER.size
+    active = numpy.nonzero(pos + OPTION.size <= ends)[0]
+    while len(active):
+        p = pos[active]
+        tag_size = gather(p, OPTION.size).view('<u2')
+        tag, size = tag_size[:, 0], tag_size[:, 1].astype(numpy.int64)
+        for t in numpy.unique(tag).tolist():
+            sel = tag == t
+            if t not in found:
+                found[t] = numpy.full(n, -1, dtype=numpy.int64), numpy.zeros(n, dtype=numpy.uint16)
+            o, s = found[t]
+            o[active[sel]] = p[sel] + OPTION.size
+            s[active[sel]] = size[sel]
+        ok = (size >= OPTION.size) & (p + size <= ends[active]) # corrupted or truncated: the chain stops there
+        active, p = active[ok], p[ok] + size[ok]
+        pos[active] = p
+        active = active[p + OPTION.size <= ends[active]]
+    for t, (o, s) in sorted(found.items()):
+        opt = options.get(t)
+        if opt is None:
+            data = numpy.zeros(n, dtype=UNKNOWN_DTYPE)
+            data['offset'], data['size'] = o, s
+            result[t] = numpy.ma.array(data, mask=o < 0)
+        else:
+            valid = (o >= 0) & (s >= OPTION.size + opt.struct.size) & (o + opt.struct.size <= ends) & (o - OPTION.size + s <= ends)
+            data = numpy.zeros(n, dtype=opt.dtype)
+            data[valid] = gather(o[valid], opt.struct.size).view(opt.dtype)[:, 0]
+            result[opt.name] = numpy.ma.array(data, mask=~valid)
+    return result
+
+#==================================================================================================
+class NavdataHistory(object):
+    """
+An instance of this class keeps the last *capacity* navdata samples (from packets with the demo option) in a ring of records of type :data:`HISTORY_DTYPE`, held in memory or, if *filename* is not None, in a file mapped in memory (so that long flights do not grow the process memory). Appending is O(1), time range queries are by bisection on the timestamps, which are assumed increasing.
+    """
+#==================================================================================================
+
+    def __init__(self, capacity, filename=None):
+        self.capacity = capacity
+        self.filename = filename
+        if filename is None: self.data = numpy.zeros(capacity, dtype=HISTORY_DTYPE)
+        else: self.data = numpy.memmap(filename, dtype=HISTORY_DTYPE, mode='w+', shape=(capacity,))
+        self.count = 0 # total number of appended samples
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, navdata):
+        """Appends sample *navdata* (as returned by :func:`navdata_decode`) received at *timestamp*."""
+        record = history_record(timestamp, navdata)
+        with self.lock:
+            self.data[self.count % self.capacity] = record
+            self.count += 1
+
+    def segments(self):
+        # the records in chronological order, as (at most) two views of the ring
+        n = self.count
+        if n <= self.capacity: return (self.data[:n],)
+        i = n % self.capacity
+        return self.data[i:], self.data[:i]
+
+    def array(self):
+        """Returns a copy of all the records, oldest first."""
+        with self.lock:
+            return numpy.concatenate(self.segments())
+
+    def last(self, n=1):
+        """Returns a copy of the last *n* records, oldest first."""
+        with self.lock:
+            segments = self.segments()
+            n = min(n, self.count, self.capacity)
+            if n <= len(segments[-1]): return segments[-1][len(segments[-1]) - n:].copy()
+            return numpy.concatenate((segments[0][len(segments[0]) + len(segments[-1]) - n:], segments[-1]))
+
+    def range(self, start=None, stop=None):
+        """Returns a copy of the records with *start* <= timestamp < *stop*, oldest first."""
+        with self.lock:
+            L = []
+            for s in self.segments():
+                t = s['timestamp']
+                i = 0 if start is None else numpy.searchsorted(t, start, 'left')
+                j = len(t) if stop is None else numpy.searchsorted(t, stop, 'left')
+                L.append(s[i:j])
+            return numpy.concatenate(L)
+
+    def flush(self):
+        if self.filename is not None: self.data.flush()
+
+_HISTORY_DEMO = ('ctrl_state', 'battery', 'theta', 'phi', 'psi', 'altitude', 'vx', 'vy', 'vz', 'num_frames')
+HISTORY_DTYPE = numpy.dtype([('timestamp', '<f8'), ('seq_nr', '<u4'), ('drone_state', '<u4')] + [(n, options[0].dtype[n]) for n in _HISTORY_DEMO])
+
+def history_record(timestamp, navdata):
+    """Returns the record of :data:`HISTORY_DTYPE` (as a tuple) of sample *navdata* (as returned by :func:`navdata_decode`) received at *timestamp*."""
+    demo = navdata[0]
+    return (timestamp, navdata['seq_nr'], navdata['drone_state'].word) + tuple(demo[n] for n in _HISTORY_DEMO)
@@ -21,12 +21,16 @@
 # THE SOFTWARE.
 
 import struct
+from collections import deque, namedtuple
 """
 The AR Drone 2.0 allows a tcp client to receive H264 (MPEG4.10 AVC) video
 from the drone. However, the frames are wrapped by Parrot Video
 Encapsulation (PaVE), which this class parses.
 """
 
+SIGNATURE = b'PaVE'
+HEADER = struct.Struct("<4sBBHIHHHHIIBBBBIIHBBBB2sI12s")
+
 """
 Usage: Pass in an output file object into the constructor, then call write on this.
 """
@@ -35,7 +39,7 @@ class PaVEParser(object):
     HEADER_SIZE_SHORT = 64; # sometimes header is longer
 
     def __init__(self, outfileobject):
-        self.buffer = ""
+        self.buffer = b""
         self.state = self.handle_header
         self.outfileobject = outfileobject
         self.misaligned_frames = 0
@@ -64,7 +68,7 @@ class PaVEParser(object):
         reserved2, advertised_size, reserved3) = struct.unpack("<4sBBHIHHHHIIBBBBIIHBBBB2sI12s",
                                                                self.buffer[0:self.HEADER_SIZE_SHORT])
 
-        if signature != "PaVE":
+        if signature != SIGNATURE:
             self.state = self.handle_misalignment
             return True
         self.buffer = self.buffer[header_size:]
@@ -73,7 +77,7 @@ class PaVEParser(object):
 
     def handle_header_drop_frames(self):
 
-        eligible_index = self.buffer.find('PaVE')
+        eligible_index = self.buffer.find(SIGNATURE)
 
         if (eligible_index < 0):
             return False
@@ -98,7 +102,7 @@ class PaVEParser(object):
                 eligible_index = current_index
                 self.payload_size = payload_size
 
-            offset = self.buffer[current_index + 1:].find('PaVE') + 1
+            offset = self.buffer[current_index + 1:].find(SIGNATURE) + 1
             if (offset == 0):
                 break
 
@@ -114,7 +118,7 @@ class PaVEParser(object):
         IFrame = False
         if self.align_on_iframe:
             while (not IFrame):
-                index = self.buffer.find('PaVE')
+                index = self.buffer.find(SIGNATURE)
                 if index == -1:
                     return False
 
@@ -133,7 +137,7 @@ class PaVEParser(object):
                 if not IFrame:
                     self.buffer = self.buffer[header_size:]
         else:
-            index = self.buffer.find('PaVE')
+            index = self.buffer.find(SIGNATURE)
             if index == -1:
                 return False
             self.buffer = self.buffer[index:]
@@ -157,3 +161,199 @@ class PaVEParser(object):
 
     def fewer_remaining_than(self, desired_size):
         return len(self.buffer) < desired_size
+
+# frame_type is 1 (IDR-frame), 2 (I-frame) or 3 (P-frame); timestamp is in ms
+PaVEFrame = namedtuple('PaVEFrame', 'position header_size payload_size frame_type frame_number timestamp')
+
+"""
+Usage: same as :class:`PaVEParser`. Alternatively, to avoid any copy on input, fill the buffer directly:
+
+  n = sock.recv_into(parser.reserve(65536))
+  parser.commit(n)
+"""
+class PaVERingParser(object):
+    """
+Same protocol as :class:`PaVEParser`, but the stream is accumulated in a preallocated :class:`bytearray`, headers are unpacked in place and payloads are passed to the output file object as :class:`memoryview` slices of that buffer (they are only valid during the call to its :meth:`write` method). Consumed bytes are reclaimed by moving the unprocessed tail back to the front of the buffer when there is not enough room at the end, so each byte is moved at most once per buffer length. The buffer is grown only when a single frame does not fit.
+
+Headers are indexed in a single pass, by hopping from one header to the next using the header and payload sizes, so spurious signatures inside payloads are never looked at, and a header is never unpacked twice. Whenever the next frame to output must be chosen, the indexed frames are submitted to *policy* (a :class:`DropPolicy` instance, default :class:`LatestIFrame`), which decides how many of them to drop. After a drop by a GOP-aware policy, or a misalignment if *align_on_iframe* is true, P-frames are dropped until the next I-frame.
+
+If *tracer* is not None (see :class:`arnetwork.FrameTracer`), its methods :meth:`parsed` and :meth:`written` are called with each frame when its header is indexed and just before its payload is output.
+    """
+
+    HEADER_SIZE_SHORT = HEADER.size
+
+    def __init__(self, outfileobject, capacity=1<<20, policy=None, align_on_iframe=True, tracer=None):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.base = 0 # stream position of the first byte of the buffer
+        self.start = 0 # offset of the first byte still needed
+        self.end = 0 # offset of the end of the buffered data
+        self.scan = 0 # stream position of the next header (or of the signature search if misaligned)
+        self.misaligned = False
+        self.frames = deque() # indexed frames, not yet selected
+        self.current = None # selected frame, waiting for its payload
+        self.emit = True # whether the selected frame is output or dropped
+        self.need_iframe = False
+        self.outfileobject = outfileobject
+        self.policy = LatestIFrame() if policy is None else policy
+        self.align_on_iframe = align_on_iframe
+        self.tracer = tracer
+        self.misaligned_frames = 0
+        self.payloads = 0
+
+    def write(self, data):
+        n = len(data)
+        self.reserve(n)[:n] = data
+        self.commit(n)
+
+    def reserve(self, size):
+        """Returns a writable view of at least *size* bytes at the end of the buffered data."""
+        if len(self.buffer) - self.end < size:
+            self.compact(size)
+        return self.view[self.end:]
+
+    def commit(self, size):
+        """Appends to the buffered data the first *size* bytes of the last reserved view, and processes them."""
+        self.end += size
+        self.index()
+        while True:
+            if self.current is None:
+                if not self.frames:
+                    break
+                self.select()
+            frame = self.current
+            stop = frame.position + frame.header_size + frame.payload_size - self.base
+            if stop > self.end:
+                break
+            if self.emit:
+                if self.tracer is not None: self.tracer.written(frame) # before: the decoder may output the image within the call
+                self.outfileobject.write(self.view[stop - frame.payload_size:stop])
+                self.payloads += 1
+            self.current = None
+        if self.current is not None: needed = self.current.position
+        elif self.frames: needed = self.frames[0].position
+        else: needed = self.scan
+        self.start = min(needed - self.base, self.end)
+
+    def compact(self, size):
+        n = self.end - self.start
+        if n + size > len(self.buffer):
+            buffer = bytearray(max(2 * len(self.buffer), n + size))
+            buffer[:n] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        else:
+            self.view[:n] = self.view[self.start:self.end] # overlapping move
+        self.base += self.start
+        self.start = 0
+        self.end = n
+
+    def index(self):
+        buffer, base, end, tracer = self.buffer, self.base, self.end, self.tracer
+        pos = self.scan - base
+        while True:
+            if self.misaligned:
+                # sometimes we start of in the middle of frame - look for the PaVE header
+                index = buffer.find(SIGNATURE, pos, end)
+                if index < 0:
+                    pos = max(pos, end - len(SIGNATURE) + 1)
+                    break
+                pos = index
+                self.misaligned = False
+                self.misaligned_frames += 1
+                if self.align_on_iframe:
+                    self.need_iframe = True
+            if end - pos < self.HEADER_SIZE_SHORT:
+                break
+            header = HEADER.unpack_from(buffer, pos)
+            if header[0] != SIGNATURE or header[3] < HEADER.size: # a shorter header is corrupt, and would not move forward
+                self.misaligned = True
+                pos += 1
+                continue
+            frame = PaVEFrame(base + pos, header[3], header[4], header[13], header[9], header[10])
+            self.frames.append(frame)
+            if tracer is not None: tracer.parsed(frame)
+            pos += header[3] + header[4]
+        self.scan = base + pos
+
+    def select(self):
+        frames, policy = self.frames, self.policy
+        if self.need_iframe:
+            n = len(frames) - 1
+            for i, frame in enumerate(frames):
+                if frame.frame_type != 3:
+                    n = i
+                    break
+        else:
+            n = policy.select(frames)
+            if n and policy.gop_aware:
+                self.need_iframe = True
+        for _ in range(n):
+            policy.dropped(frames.popleft())
+        frame = self.current = frames.popleft()
+        self.emit = not self.need_iframe or frame.frame_type != 3
+        if self.emit: self.need_iframe = False
+        else: policy.dropped(frame)
+
+#==================================================================================================
+# Frame drop policies
+#==================================================================================================
+
+class DropPolicy(object):
+    """
+Base class of the frame drop policies of :class:`PaVERingParser`. Method :meth:`select` is passed the (non empty) deque of the frames whose header has been received but which have not been output yet, oldest first, and returns how many of them to drop. Only the last one may be incomplete. Attribute :attr:`gop_aware` tells whether the frames following a drop must be dropped up to the next I-frame.
+    """
+
+    gop_aware = True
+
+    def __init__(self):
+        self.dropped_iframes = 0
+        self.dropped_pframes = 0
+
+    def select(self, frames):
+        raise NotImplementedError()
+
+    def dropped(self, frame):
+        if frame.frame_type == 3: self.dropped_pframes += 1
+        else: self.dropped_iframes += 1
+
+class NeverDrop(DropPolicy):
+    """Outputs all the frames."""
+    def select(self, frames):
+        return 0
+
+class NewestFrame(DropPolicy):
+    """Outputs the most recent frame only, whatever its type (the image may be corrupted until the next I-frame)."""
+    gop_aware = False
+    def select(self, frames):
+        return len(frames) - 1
+
+class LatestIFrame(DropPolicy):
+    """Jumps to the most recent I-frame, if any, otherwise outputs all the frames."""
+    def select(self, frames):
+        n = len(frames) - 1
+        for frame in reversed(frames):
+            if frame.frame_type != 3:
+                return n
+            n -= 1
+        return 0
+
+class BoundedLatency(DropPolicy):
+    """
+Drops the frames older than *max_latency* ms with respect to the most recent frame. When frames are dropped, the output resumes at the first I-frame within the bound if there is one, otherwise at the next I-frame.
+    """
+    def __init__(self, max_latency):
+        super(BoundedLatency, self).__init__()
+        self.max_latency = max_latency
+    def select(self, frames):
+        latest = frames[-1].timestamp
+        n = 0
+        for frame in frames:
+            if (latest - frame.timestamp) & 0xffffffff <= self.max_latency:
+                break
+            n += 1
+        if n:
+            for i, frame in enumerate(frames):
+                if i >= n and frame.frame_type != 3:
+                    return i
+        return n
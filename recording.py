@@ -0,0 +1,238 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Recording of the raw data sent by the drone, and replay. A recording is an append-only file of chunks, each holding a navdata datagram or a piece of the PaVE video stream as received from the socket, with its reception time. Closing the recorder appends an index of the chunks and of the I-frames of the video; a recording without index (e.g. interrupted) is indexed again when opened. Usage::
+
+  drone = ARDrone(record='flight.ardrone')
+  ...
+  drone.halt()
+
+  drone = ARDrone(replay=Replay('flight.ardrone'))
+"""
+
+import mmap
+import time
+import struct
+import threading
+import numpy
+
+import paveparser
+
+MAGIC = b'ARDR'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sI') # magic, version
+CHUNK = struct.Struct('<BxxxId') # kind, size, timestamp (time.time() at reception)
+FOOTER = struct.Struct('<4sQ') # magic, offset of the index chunk
+INDEX_MAGIC = b'ARDI'
+
+# kinds of chunks
+NAVDATA = 1
+VIDEO = 2
+INDEX = 3
+KEYFRAMES = 4
+SEEK = 5 # yielded by Replay.play, never written
+
+# position is the position in the video stream of the first byte of a video chunk (-1 for the others)
+INDEX_DTYPE = numpy.dtype([('timestamp', '<f8'), ('kind', 'u1'), ('offset', '<i8'), ('size', '<u4'), ('position', '<i8')])
+# position is the position in the video stream of the header of an I-frame, timestamp the time of its reception
+KEYFRAME_DTYPE = numpy.dtype([('position', '<i8'), ('frame_number', '<u4'), ('timestamp', '<f8')])
+
+#==================================================================================================
+class KeyframeIndexer(object):
+    """
+An instance of this class indexes the I-frames of a PaVE stream fed by :meth:`feed`, in attribute :attr:`keyframes` (a list of tuples of type :data:`KEYFRAME_DTYPE`). It acts as the tracer of its own :class:`paveparser.PaVERingParser`.
+    """
+#==================================================================================================
+
+    def __init__(self):
+        self.parser = paveparser.PaVERingParser(self, policy=paveparser.NeverDrop(), tracer=self)
+        self.timestamp = 0.
+        self.keyframes = []
+
+    def feed(self, data, timestamp):
+        self.timestamp = timestamp
+        self.parser.write(data)
+
+    def parsed(self, frame):
+        if frame.frame_type != 3: self.keyframes.append((frame.position, frame.frame_number, self.timestamp))
+
+    def written(self, frame):
+        pass
+
+    def write(self, payload): # output of the parser
+        pass
+
+#==================================================================================================
+class Recorder(object):
+    """
+An instance of this class writes a recording to file *filename*. Methods :meth:`navdata` and :meth:`video` append a chunk, and may be called from different threads. The file is written through a buffer, so that the writes do not block the network threads.
+    """
+#==================================================================================================
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self.offset = FILE_HEADER.size
+        self.position = 0 # size of the video stream
+        self.index = []
+        self.indexer = KeyframeIndexer()
+        self.lock = threading.Lock()
+
+    def navdata(self, data, timestamp=None):
+        self.append(NAVDATA, data, timestamp)
+
+    def video(self, data, timestamp=None):
+        self.append(VIDEO, data, timestamp)
+
+    def append(self, kind, data, timestamp=None):
+        if timestamp is None: timestamp = time.time()
+        size = len(data)
+        with self.lock:
+            self.file.write(CHUNK.pack(kind, size, timestamp))
+            self.file.write(data)
+            self.index.append((timestamp, kind, self.offset + CHUNK.size, size, self.position if kind == VIDEO else -1))
+            self.offset += CHUNK.size + size
+            if kind == VIDEO:
+                self.indexer.feed(data, timestamp)
+                self.position += size
+
+    def close(self):
+        """Appends the indexes and closes the file."""
+        with self.lock:
+            if self.file.closed: return
+            index = numpy.array(self.index, dtype=INDEX_DTYPE).tobytes()
+            keyframes = numpy.array(self.indexer.keyframes, dtype=KEYFRAME_DTYPE).tobytes()
+            offset = self.offset
+            self.file.write(CHUNK.pack(INDEX, len(index), time.time()))
+            self.file.write(index)
+            self.file.write(CHUNK.pack(KEYFRAMES, len(keyframes), time.time()))
+            self.file.write(keyframes)
+            self.file.write(FOOTER.pack(INDEX_MAGIC, offset))
+            self.file.close()
+
+#==================================================================================================
+class Replay(object):
+    """
+An instance of this class reads the recording *filename*, mapped in memory. Attribute :attr:`index` is the array of the navdata and video chunks (type :data:`INDEX_DTYPE`), :attr:`keyframes` the array of the I-frames (type :data:`KEYFRAME_DTYPE`). The data are played by :meth:`play`, at speed *speed* (1 for real time, None for as fast as possible), from *start* seconds.
+    """
+#==================================================================================================
+
+    def __init__(self, filename, speed=1., start=0.):
+        self.speed = speed
+        self.start = start
+        self.request = None # pending goto
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC: raise ValueError('{} is not a recording'.format(filename))
+        if version != VERSION: raise ValueError('unsupported recording version {}'.format(version))
+        self.index = self.keyframes = None
+        if len(self.map) >= FILE_HEADER.size + FOOTER.size:
+            magic, offset = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+            if magic == INDEX_MAGIC: self.load_index(offset)
+        if self.index is None: self.build_index()
+        self.video = self.index[self.index['kind'] == VIDEO]
+
+    def load_index(self, offset):
+        chunks = []
+        for _ in range(2):
+            kind, size, _ = CHUNK.unpack_from(self.map, offset)
+            chunks.append(numpy.frombuffer(self.map, dtype=INDEX_DTYPE if kind == INDEX else KEYFRAME_DTYPE, count=size // (INDEX_DTYPE.itemsize if kind == INDEX else KEYFRAME_DTYPE.itemsize), offset=offset + CHUNK.size))
+            offset += CHUNK.size + size
+        self.index, self.keyframes = chunks
+
+    def build_index(self):
+        """Indexes a recording without index, up to its last complete chunk."""
+        index = []
+        indexer = KeyframeIndexer()
+        offset, position, end = FILE_HEADER.size, 0, len(self.map)
+        while offset + CHUNK.size <= end:
+            kind, size, timestamp = CHUNK.unpack_from(self.map, offset)
+            if offset + CHUNK.size + size > end or kind not in (NAVDATA, VIDEO): break
+            index.append((timestamp, kind, offset + CHUNK.size, size, position if kind == VIDEO else -1))
+            if kind == VIDEO:
+                indexer.feed(self.map[offset + CHUNK.size:offset + CHUNK.size + size], timestamp)
+                position += size
+            offset += CHUNK.size + size
+        self.index = numpy.array(index, dtype=INDEX_DTYPE)
+        self.keyframes = numpy.array(indexer.keyframes, dtype=KEYFRAME_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def duration(self):
+        """Duration of the recording, in seconds."""
+        return float(self.index['timestamp'][-1] - self.index['timestamp'][0]) if len(self.index) else 0.
+
+    def seek(self, t):
+        """
+Returns a pair (i, position): the index of the first chunk to play to start at *t* seconds from the start of the recording, and the position in the video stream where the playing of the video starts. The starting point is snapped to the nearest I-frame, if any.
+        """
+        if not len(self.index): return 0, 0
+        t0 = self.index['timestamp'][0]
+        when = t0 + t
+        if len(self.keyframes):
+            k = int(numpy.abs(self.keyframes['timestamp'] - when).argmin())
+            position = int(self.keyframes['position'][k])
+            # the first video chunk holding the frame
+            v = int(numpy.searchsorted(self.video['position'], position, 'right')) - 1
+            when = min(when, float(self.video['timestamp'][v]))
+        else:
+            position = 0
+        i = int(numpy.searchsorted(self.index['timestamp'], when, 'left'))
+        return i, position
+
+    def goto(self, t):
+        """Makes :meth:`play` continue from *t* seconds from the start of the recording. Can be called from any thread."""
+        self.request = t
+
+    def play(self):
+        """
+Generator of the chunks from :attr:`start` seconds (see :meth:`seek`), as tuples (kind, timestamp, data), where *data* is a :class:`memoryview` of the mapped file. The chunks are yielded at their time in the recording divided by :attr:`speed` (as fast as possible if None or 0). After a call to :meth:`goto`, a tuple (:data:`SEEK`, time, None) is yielded before the chunks from the new point, so that the consumer resets its parsing.
+        """
+        self.request = None
+        i, position = self.seek(self.start)
+        view = memoryview(self.map)
+        while True:
+            index = self.index[i:]
+            t0 = time.perf_counter()
+            r0 = index['timestamp'][0] if len(index) else 0.
+            for timestamp, kind, offset, size, pos in index.tolist():
+                if self.request is not None: break
+                if self.speed:
+                    delay = t0 + (timestamp - r0) / self.speed - time.perf_counter()
+                    if delay > 0: time.sleep(delay)
+                if kind == VIDEO:
+                    if pos + size <= position: continue
+                    if pos < position: # the chunk holding the start I-frame
+                        offset += position - pos
+                        size -= position - pos
+                yield kind, timestamp, view[offset:offset + size]
+            if self.request is None: break
+            t, self.request = self.request, None
+            i, position = self.seek(t)
+            yield SEEK, t, None
+
+    def close(self):
+        """Unmaps the file. The data yielded by :meth:`play` must have been released."""
+        self.index = self.keyframes = self.video = None # views of the map
+        self.map.close()
@@ -0,0 +1,400 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+A simulator of the drone, speaking its protocols on the local host, to exercise the network paths of the package without hardware. It parses the AT commands received on the command port, sends navdata packets at 15 Hz (demo mode) or 200 Hz (full mode, with all the option tags) to the client which sent a packet to the navdata port, serves a PaVE stream on the video port and accepts connections on the control port. Run as::
+
+  python simulator.py [--video FILE.h264] [--bitrate KBITS] [--loss P] [--jitter SECONDS]
+
+The drones must then be given host ``127.0.0.1``, and, as the simulator binds the navdata port, a free local navdata port::
+
+  drone = libardrone.ARDrone(host='127.0.0.1', ports=dict(navdata_client=0))
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import re
+import time
+import random
+import socket
+import threading
+from collections import Counter, deque
+
+import libardrone
+import navdata
+import paveparser
+
+#==================================================================================================
+# Packets
+#==================================================================================================
+
+DEMO_FIELDS = navdata.options[0].names
+
+def navdata_packet(seq_nr, state=0, demo=None, full=False):
+    """
+Returns a navdata packet with sequence number *seq_nr*, drone state word *state*, the demo option with values *demo* (a dict of the fields of the demo option, all zero by default), and, if *full*, all the other known options (zero filled), followed by the checksum option.
+    """
+    demo = demo or {}
+    chunks = [navdata.HEADER.pack(navdata.NAVDATA_HEADER, state, seq_nr, 0)]
+    for o in sorted(navdata.options.values(), key=lambda o: o.tag) if full else (navdata.options[0],):
+        if o.name == 'checksum': continue
+        if o.tag == 0: payload = o.struct.pack(*(demo.get(n, 0) for n in DEMO_FIELDS))
+        else: payload = bytes(o.struct.size)
+        chunks.append(navdata.OPTION.pack(o.tag, navdata.OPTION.size + len(payload)))
+        chunks.append(payload)
+    packet = b''.join(chunks)
+    return packet + navdata.OPTION.pack(0xffff, 8) + navdata.options[0xffff].struct.pack(sum(packet) & 0xffffffff)
+
+def pave_header(width, height, frame_number, timestamp, frame_type, payload_size):
+    """Returns a PaVE header (frame_type 1 for an I-frame, 3 for a P-frame, timestamp in ms)."""
+    return paveparser.HEADER.pack(
+      paveparser.SIGNATURE, 3, 4, paveparser.HEADER.size, payload_size, width, height, width, height,
+      frame_number, timestamp, 1, 0, frame_type, 0, 0, 0, 0, 1, 0, 0, 0, b'\0\0', 0, bytes(12))
+
+AT_COMMAND = re.compile(rb'AT\*([A-Z_]+)=(\d+)(?:,([^\r]*))?\r')
+
+def at_decode(data):
+    """Yields the (name, seq, args) of the AT commands in datagram *data*, the args as a list of strings (unquoted) and ints."""
+    for m in AT_COMMAND.finditer(data):
+        args = []
+        if m.group(3):
+            for a in m.group(3).decode('ascii').split(','):
+                args.append(a[1:-1] if a.startswith('"') else int(a))
+        yield m.group(1).decode('ascii'), int(m.group(2)), args
+
+def i2f(i):
+    """Interpret an int (as encoded by :func:`libardrone.f2i`) as a float."""
+    return libardrone._F1.unpack(libardrone._I1.pack(i))[0]
+
+def h264_frames(data):
+    """
+Splits the H.264 Annex B stream *data* into frames. Returns a list of pairs (frame_type, bytes), where frame_type is 1 for frames with an IDR slice and 3 otherwise, and the bytes of a frame include the parameter sets preceding it.
+    """
+    starts = [m.end() for m in re.finditer(b'\0\0\1', data)]
+    frames = []
+    nals = []
+    idr = False
+    for i, s in enumerate(starts):
+        e = starts[i + 1] - 3 if i + 1 < len(starts) else len(data)
+        nal = data[s:e].rstrip(b'\0') # a 4 bytes start code leaves a trailing 0
+        if not nal: continue
+        nals.append(nal)
+        t = nal[0] & 0x1f
+        idr |= t == 5
+        if t in (1, 5):
+            frames.append((1 if idr else 3, b''.join(b'\0\0\0\1' + n for n in nals)))
+            nals = []
+            idr = False
+    return frames
+
+def synthetic_frames(bitrate, fps, gop=30, seed=0):
+    """Returns one GOP of frames of random bytes at *bitrate* kbit/s, as :func:`h264_frames`, with I-frames 5 times bigger than P-frames."""
+    rnd = random.Random(seed)
+    psize = int(bitrate * 125 * gop / (fps * (gop + 4)))
+    block = bytes(rnd.getrandbits(8) for _ in range(64))
+    frames = []
+    for n in range(gop):
+        size = 5 * psize if n == 0 else psize
+        frames.append((1 if n == 0 else 3, block * (size // 64) + bytes(size % 64)))
+    return frames
+
+# part of the configuration of a drone, as sent on the control port
+DEFAULT_CONFIG = {
+  'general:num_version_config': 1,
+  'general:num_version_mb': 33,
+  'general:num_version_soft': '2.4.8',
+  'general:drone_serial': 'XXXXXXXXXX',
+  'general:navdata_demo': 'TRUE',
+  'general:navdata_options': 105971713,
+  'control:altitude_max': 3000,
+  'control:altitude_min': 50,
+  'control:euler_angle_max': 0.2094395,
+  'control:control_vz_max': 700,
+  'control:control_yaw': 1.745329,
+  'control:outdoor': 'FALSE',
+  'control:flight_without_shell': 'FALSE',
+  'network:ssid_single_player': 'ardrone2_simulated',
+  'video:codec_fps': 30,
+  'video:video_codec': 129,
+  'video:bitrate': 1000,
+  'video:max_bitrate': 4000,
+  'video:bitrate_control_mode': 0,
+  'video:video_channel': 0,
+  'leds:leds_anim': '0,0,0',
+  'custom:application_id': '00000000',
+  'custom:profile_id': '00000000',
+  'custom:session_id': '00000000',
+  }
+
+#==================================================================================================
+class Simulator(object):
+    """
+An instance of this class simulates a drone on *host*, on ports *ports* (see :data:`libardrone.ARDRONE_PORTS`). Its threads are started by :meth:`start` and stopped by :meth:`stop`.
+
+The video is read from *video*, an H.264 Annex B file, or, if None, made of random bytes at *bitrate* kbit/s. The frames are sent at *fps* frames/sec, limited by *bitrate* if the video comes from a file. Each frame is dropped with probability *loss* and delayed by a random time between 0 and *jitter* seconds (the order of the frames is kept).
+
+The commands received are counted by name in :attr:`commands`, and the last *log* of them are kept in :attr:`log` as tuples (arrival time on the :func:`time.perf_counter` clock, name, seq, args), for latency measurements. Likewise, the last *log* video frames sent are kept in :attr:`frame_log` as pairs (sending time, frame number).
+    """
+#==================================================================================================
+
+    def __init__(self, host='127.0.0.1', ports=None, video=None, bitrate=1000, fps=30, loss=0., jitter=0., hd=False, log=10000, seed=0):
+        self.host = host
+        self.ports = dict(libardrone.ARDRONE_PORTS, **(ports or {}))
+        self.bitrate = bitrate
+        self.fps = fps
+        self.loss = loss
+        self.jitter = jitter
+        self.shape = (1280, 720) if hd else (640, 360)
+        if video is None:
+            self.video = synthetic_frames(bitrate, fps, seed=seed)
+            self.throttle = False
+        else:
+            with open(video, 'rb') as f: self.video = h264_frames(f.read())
+            self.throttle = bitrate is not None
+        self.rnd = random.Random(seed)
+        self.running = False
+        self.threads = []
+        self.sockets = []
+        self.lock = threading.Lock()
+        # state of the drone
+        self.config = {}
+        self.demo_mode = True
+        self.flying = False
+        self.emergency = False
+        self.ack = False # acknowledgement of a configuration command
+        self.controls = [] # control connections
+        self.pcmd = (0, 0., 0., 0., 0.)
+        self.demo = dict((n, 0) for n in DEMO_FIELDS)
+        self.demo.update(ctrl_state=2 << 16, battery=100)
+        self.battery = 100.
+        self.last_command = time.perf_counter()
+        # statistics
+        self.commands = Counter()
+        self.log = deque(maxlen=log)
+        self.frame_log = deque(maxlen=log)
+        self.navdata_sent = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+    #----------------------------------------------------------------------------------------------
+    # Threads
+    #----------------------------------------------------------------------------------------------
+
+    def start(self):
+        self.running = True
+        command = self.socket(socket.SOCK_DGRAM, 'command')
+        nav = self.socket(socket.SOCK_DGRAM, 'navdata')
+        control = self.socket(socket.SOCK_STREAM, 'control')
+        video = self.socket(socket.SOCK_STREAM, 'video')
+        for target, args in (
+          (self.command_process, (command,)),
+          (self.navdata_process, (nav,)),
+          (self.serve, (control, self.control_process)),
+          (self.serve, (video, self.video_process)),
+          ):
+            self.spawn(target, *args)
+        logger.info('[simulator] Listening on %s %s', self.host, self.ports)
+        return self
+
+    def stop(self):
+        self.running = False
+        for t in self.threads: t.join()
+        for s in self.sockets: s.close()
+
+    def socket(self, kind, port):
+        s = socket.socket(socket.AF_INET, kind)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((self.host, self.ports[port]))
+        if kind == socket.SOCK_STREAM: s.listen(4)
+        s.settimeout(.2) # so that the threads check running
+        self.sockets.append(s)
+        return s
+
+    def spawn(self, target, *args):
+        t = threading.Thread(target=target, args=args)
+        t.daemon = True
+        t.start()
+        self.threads.append(t)
+
+    def serve(self, sock, process):
+        while self.running:
+            try: conn, _ = sock.accept()
+            except socket.timeout: continue
+            conn.settimeout(.2)
+            self.sockets.append(conn)
+            self.spawn(process, conn)
+
+    def command_process(self, sock):
+        while self.running:
+            try: data = sock.recv(65535)
+            except socket.timeout: continue
+            t = time.perf_counter()
+            with self.lock:
+                self.last_command = t
+                for name, seq, args in at_decode(data):
+                    self.commands[name] += 1
+                    self.log.append((t, name, seq, args))
+                    self.execute(name, args)
+
+    def execute(self, name, args):
+        if name == 'REF':
+            if args[0] & 1 << 8:
+                if self.flying or self.emergency: self.emergency = not self.emergency
+                self.flying = False
+            elif not self.emergency:
+                self.flying = bool(args[0] & 1 << 9)
+        elif name == 'PCMD':
+            self.pcmd = (args[0],) + tuple(i2f(a) for a in args[1:5])
+        elif name == 'CONFIG':
+            self.config[args[0]] = args[1]
+            if args[0] == 'general:navdata_demo': self.demo_mode = args[1] == 'TRUE'
+            self.ack = True
+        elif name == 'CTRL':
+            if args[0] == 5: self.ack = False # ACK_CONTROL_MODE
+            elif args[0] == 4: self.send_config() # CFG_GET_CONTROL_MODE
+
+    def navdata_process(self, sock):
+        client = None
+        seq_nr = 0
+        deadline = time.perf_counter()
+        while self.running:
+            period = 1. / 15 if self.demo_mode else 1. / 200
+            deadline += period
+            while True: # wait for the deadline, serving the (re)connections of the client
+                delay = deadline - time.perf_counter()
+                if delay <= 0: break
+                sock.settimeout(delay)
+                try: _, client = sock.recvfrom(4096)
+                except socket.timeout: pass
+            if client is None: continue
+            seq_nr += 1
+            with self.lock:
+                self.update(period)
+                packet = navdata_packet(seq_nr, self.state(), self.demo, not self.demo_mode)
+            try: sock.sendto(packet, client)
+            except OSError: continue
+            self.navdata_sent += 1
+
+    def update(self, dt):
+        """Integrates the motion of the drone over *dt* seconds."""
+        d = self.demo
+        if self.flying:
+            flag, roll, pitch, gaz, yaw = self.pcmd
+            if d['ctrl_state'] >> 16 in (2, 6) and d['altitude'] < 800:
+                d['ctrl_state'] = 6 << 16 # taking off
+                gaz = 1.
+            else:
+                d['ctrl_state'] = (3 if flag else 4) << 16 # flying or hovering
+                if not flag: roll = pitch = 0.
+            d['theta'] = pitch * 12000. # millidegrees
+            d['phi'] = roll * 12000.
+            d['psi'] = (d['psi'] + yaw * 100000. * dt + 180000.) % 360000. - 180000.
+            d['vx'], d['vy'], d['vz'] = -pitch * 2000., roll * 2000., gaz * 700.
+            d['altitude'] = int(max(d['altitude'] + gaz * 700. * dt, 0))
+        else:
+            d['ctrl_state'] = (2 if d['altitude'] == 0 else 8) << 16 # landed or landing
+            d['theta'] = d['phi'] = d['vx'] = d['vy'] = 0.
+            d['vz'] = -700. if d['altitude'] > 0 else 0.
+            d['altitude'] = int(max(d['altitude'] - 700. * dt, 0))
+        if d['altitude'] > 0: self.battery = max(self.battery - dt / 6., 0.) # 10% per minute
+        d['battery'] = int(self.battery)
+
+    def state(self):
+        s = 1 << 1 | 1 << 24 | 1 << 25 | 1 << 26 | 1 << 27
+        if self.flying: s |= 1
+        if self.demo_mode: s |= 1 << 10
+        if self.ack: s |= 1 << 6
+        if self.emergency: s |= 1 << 31
+        if time.perf_counter() - self.last_command > .25: s |= 1 << 30
+        if self.demo['battery'] < 20: s |= 1 << 15
+        return s
+
+    def send_config(self):
+        """Sends the configuration as text to the control connections."""
+        config = dict(DEFAULT_CONFIG, **self.config)
+        text = ''.join('{} = {}\n'.format(k, v) for k, v in sorted(config.items())).encode('ascii')
+        for conn in self.controls:
+            try: conn.sendall(text)
+            except OSError: pass
+
+    def control_process(self, conn):
+        self.controls.append(conn)
+        while self.running:
+            try:
+                if not conn.recv(4096): break
+            except socket.timeout: continue
+            except OSError: break
+        self.controls.remove(conn)
+        conn.close()
+
+    def video_process(self, conn):
+        width, height = self.shape
+        start = time.perf_counter()
+        deadline = sent = start
+        frame_number = 0
+        try:
+            while self.running:
+                for frame_type, payload in self.video:
+                    if not self.running: break
+                    frame_number += 1
+                    deadline += 1. / self.fps
+                    if self.rnd.random() < self.loss:
+                        self.frames_dropped += 1
+                        continue
+                    t = max(deadline + self.rnd.uniform(0., self.jitter), sent)
+                    delay = t - time.perf_counter()
+                    if delay > 0: time.sleep(delay)
+                    header = pave_header(width, height, frame_number, int((deadline - start) * 1000), frame_type, len(payload))
+                    conn.sendall(header + payload)
+                    sent = time.perf_counter()
+                    self.frame_log.append((sent, frame_number))
+                    if self.throttle: sent += 8. * (len(header) + len(payload)) / (self.bitrate * 1000.)
+                    self.frames_sent += 1
+        except OSError as e:
+            logger.info('[simulator] Video connection closed: %s', e)
+        conn.close()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Simulates a drone on the local host.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--video', help='H.264 Annex B file streamed in a loop (random bytes if not given)')
+    parser.add_argument('--bitrate', type=float, default=1000., help='video bitrate in kbit/s')
+    parser.add_argument('--fps', type=float, default=30.)
+    parser.add_argument('--loss', type=float, default=0., help='probability of dropping a video frame')
+    parser.add_argument('--jitter', type=float, default=0., help='maximum delay of a video frame, in seconds')
+    parser.add_argument('--hd', action='store_true')
+    parser.add_argument('--base-port', type=int, help='ports are base-port+0 (navdata), +1 (video), +2 (command), +5 (control) instead of the standard ones')
+    args = parser.parse_args()
+    ports = None
+    if args.base_port is not None:
+        ports = dict(navdata=args.base_port, video=args.base_port + 1, command=args.base_port + 2, control=args.base_port + 5)
+    logging.basicConfig(level=logging.INFO)
+    sim = Simulator(args.host, ports, args.video, args.bitrate, args.fps, args.loss, args.jitter, args.hd).start()
+    try:
+        while True: time.sleep(1.)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    logger.info('[simulator] %d navdata packets, %d frames sent (%d dropped), commands %s', sim.navdata_sent, sim.frames_sent, sim.frames_dropped, dict(sim.commands))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Tests of :mod:`arnetwork`, run with pytest.
+"""
+
+import libardrone
+import recording
+import simulator
+from fleet import Reactor
+
+def test_halt_replay_in_reactor_mode(tmp_path):
+    filename = str(tmp_path / 'flight.ardr')
+    recorder = recording.Recorder(filename)
+    for seq in range(1, 11): recorder.navdata(simulator.navdata_packet(seq), seq * .005)
+    recorder.close()
+    reactor = Reactor()
+    try:
+        drone = libardrone.ARDrone(reactor=reactor, replay=recording.Replay(filename, speed=None), video=False)
+        drone.halt()
+    finally:
+        reactor.stop()
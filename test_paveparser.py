@@ -0,0 +1,46 @@
+# Python AR.Drone 2.0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Tests of :mod:`paveparser`, run with pytest.
+"""
+
+import paveparser
+import simulator
+
+class Output(object):
+    """File object collecting the payloads written."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def write(self, data):
+        self.payloads.append(bytes(data))
+
+def test_ring_parser_skips_zero_size_header():
+    header = bytearray(simulator.pave_header(640, 360, 1, 0, 1, 0))
+    header[6:12] = bytes(6) # header_size and payload_size 0: would never move forward
+    payload = b'\x00\x00\x00\x01frame'
+    output = Output()
+    parser = paveparser.PaVERingParser(output)
+    parser.write(bytes(header) + simulator.pave_header(640, 360, 2, 33, 1, len(payload)) + payload)
+    assert output.payloads == [payload]
+    assert parser.misaligned_frames == 1
+    assert not parser.frames